@@ -0,0 +1,13 @@
+use refactoring_analysis;
+
+-- Composite indexes for computing the involvement relation in MySQL (ANALYSIS_INVOLVEMENT_JOIN=sql).
+-- conflicting_region_history rows are matched to refactoring_region rows of the same project and commit, and only
+-- regions of refactorings of the accepted types take part.
+create index crh_project_commit on conflicting_region_history (project_id, commit_hash(40));
+create index rr_project_commit_type on refactoring_region (project_id, commit_hash(40), type(1), refactoring_id);
+create index refactoring_type_id on refactoring (refactoring_type(64), id);
+
+-- To remove them again:
+-- drop index crh_project_commit on conflicting_region_history;
+-- drop index rr_project_commit_type on refactoring_region;
+-- drop index refactoring_type_id on refactoring;
@@ -0,0 +1,152 @@
+import argparse
+import contextlib
+import gc
+import inspect
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from synthetic import default_scale, generate_database
+
+# get_* functions that take no arguments but need clones of the projects, or return no data frame
+excluded_functions = ['get_db_connection', 'get_refactoring_types_sql_condition',
+                      'get_involved_refactorings_by_refactoring_type', 'get_merge_scenario_involved_refactorings',
+                      'get_merge_scenarios_involved_refactorings']
+
+
+# The get_* functions of a module that can be called without arguments, in source order
+def get_benchmarked_functions(module):
+    functions = list()
+    for name, function in inspect.getmembers(module, inspect.isfunction):
+        if name.startswith('get_') and name not in excluded_functions and function.__module__ == module.__name__ and \
+                all(parameter.default is not parameter.empty
+                    for parameter in inspect.signature(function).parameters.values()):
+            functions.append((inspect.getsourcelines(function)[1], name, function))
+    return [(name, function) for _, name, function in sorted(functions)]
+
+
+# Calls function, going through the result when it is a generator
+def call(function):
+    result = function()
+    return list(result) if inspect.isgenerator(result) else result
+
+
+def count_rows(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    return len(result) if hasattr(result, '__len__') else None
+
+
+# Every call starts from nothing shared with the calls before: no memoized involvement relation, no dictionaries of
+# the compact representation and an empty cache directory.
+def reset_state(cache_directory):
+    import cache
+    import data_resolver
+    import encoding
+    data_resolver.involvement_by_fingerprint.clear()
+    encoding.domains.clear()
+    shutil.rmtree(cache_directory, ignore_errors=True)
+    cache.cache_dir = cache_directory
+    cache.cached_bytes.pop(cache_directory, None)
+    gc.collect()
+
+
+# Seconds of one call of function, and with memory, the peak of the memory allocated during a second call in this
+# process (worker processes of parallel.py are not traced)
+def measure(function, cache_directory, memory=True):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        reset_state(cache_directory)
+        start = time.perf_counter()
+        result = call(function)
+        seconds = time.perf_counter() - start
+        rows = count_rows(result)
+        del result
+
+        peak = None
+        if memory:
+            reset_state(cache_directory)
+            tracemalloc.start()
+            try:
+                call(function)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return seconds, rows, peak
+
+
+# Generates the database of one scale and measures every function on it. Runs in a process of its own, so that nothing
+# loaded for a smaller scale is around any more.
+def run_scale(factor, scale, directory, memory=True):
+    path = os.path.abspath(os.path.join(directory, 'synthetic_{}.db'.format(factor)))
+    table_rows = generate_database(path, scale)
+    input_rows = sum(table_rows.values()) - table_rows['project']
+
+    import database
+    database.set_backend('mysql')
+    database.set_database_url('sqlite:///' + path)
+    import data_resolver
+    import refactorings_analyzer
+
+    working_directory = tempfile.mkdtemp(dir=directory)
+    # refactorings_analyzer writes its results into results/ of the working directory
+    os.makedirs(os.path.join(working_directory, 'results'))
+    os.chdir(working_directory)
+
+    measurements = list()
+    for module in [data_resolver, refactorings_analyzer]:
+        for name, function in get_benchmarked_functions(module):
+            seconds, rows, peak = measure(function, os.path.join(working_directory, 'cache'), memory)
+            measurements.append({
+                'scale': factor, 'projects': scale['projects'], 'merges': scale['merges'], 'input_rows': input_rows,
+                'function': '{}.{}'.format(module.__name__, name), 'seconds': seconds, 'output_rows': rows,
+                'rows_per_second': input_rows / seconds if seconds > 0 else None,
+                'peak_mb': peak / 1024. ** 2 if peak is not None else None,
+            })
+            print_measurement(measurements[-1])
+    database.dispose_engine()
+    return measurements
+
+
+def print_measurement(measurement):
+    print('{:>6} {:<80} {:>9.3f}s {:>12} rows/s {:>10} MB'.format(
+        measurement['scale'], measurement['function'], measurement['seconds'],
+        '-' if measurement['rows_per_second'] is None else '{:.0f}'.format(measurement['rows_per_second']),
+        '-' if measurement['peak_mb'] is None else '{:.1f}'.format(measurement['peak_mb'])))
+
+
+# Runs the functions on synthetic databases of growing size: the number of merge commits per project of scale is
+# multiplied by each factor in turn. Returns one row per scale and function.
+def run_benchmark(factors, scale=None, directory=None, memory=True):
+    scale = dict(default_scale, **(scale or dict()))
+    directory = directory or tempfile.mkdtemp(prefix='benchmark')
+    os.makedirs(directory, exist_ok=True)
+    measurements = list()
+    for factor in factors:
+        scaled = dict(scale, merges=int(scale['merges'] * factor))
+        print('Scale {}: {} projects with {} merge commits each'.format(factor, scaled['projects'], scaled['merges']))
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            measurements.extend(executor.submit(run_scale, factor, scaled, directory, memory).result())
+    return pd.DataFrame(measurements)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the get_* functions of data_resolver and refactorings_analyzer on synthetic databases.')
+    parser.add_argument('--scales', nargs='+', type=float, default=[1, 2, 4],
+                        help='factors to multiply the merge commits per project by')
+    parser.add_argument('--directory', help='directory for the generated databases (default: a temporary one)')
+    parser.add_argument('--output', default='benchmark.csv', help='CSV file to write the measurements to')
+    parser.add_argument('--no-memory', action='store_true', help='skip the second, traced call of every function')
+    for option in ['projects', 'merges', 'path_skew']:
+        parser.add_argument('--' + option.replace('_', '-'), type=type(default_scale[option]),
+                            default=default_scale[option], dest=option)
+    args = parser.parse_args()
+    results = run_benchmark(args.scales, {'projects': args.projects, 'merges': args.merges,
+                                          'path_skew': args.path_skew}, args.directory, not args.no_memory)
+    results.to_csv(args.output, index=False)
+    print('Wrote {} measurements to {}'.format(len(results), args.output))
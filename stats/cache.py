@@ -0,0 +1,163 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+cache_dir = os.environ.get('ANALYSIS_CACHE_DIR', 'cache')
+# Once the cache grows over this many bytes, the least recently used entries are evicted
+max_cache_bytes = int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', str(4 * 1024 ** 3)))
+cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+# cache directory -> bytes of its entries, counted once per process and kept up to date by store, so that a store only
+# scans the directory when the cache has grown over max_cache_bytes
+cached_bytes = dict()
+
+
+def digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+# Entries are named <name>-<digest of the parameters>-<fingerprint of the source data>.<format>
+def entry_prefix(name, params):
+    return os.path.join(cache_dir, '{}-{}-'.format(name, digest(params or dict())))
+
+
+def find_entry(prefix, fingerprint):
+    for extension in ['.parquet', '.pickle']:
+        if os.path.isfile(prefix + fingerprint + extension):
+            return prefix + fingerprint + extension
+    return None
+
+
+def read_entry(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def write_atomically(path, write):
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.isfile(temporary_path):
+            os.remove(temporary_path)
+
+
+# Data frames go to Parquet when pyarrow is installed; anything Parquet cannot hold (other objects, non-string column
+# names, mixed-type columns) is pickled instead. Returns the path written.
+def write_entry(path_without_extension, value):
+    os.makedirs(cache_dir, exist_ok=True)
+    if pyarrow is not None and isinstance(value, pd.DataFrame):
+        try:
+            write_atomically(path_without_extension + '.parquet', lambda path: value.to_parquet(path, engine='pyarrow'))
+            return path_without_extension + '.parquet'
+        except (ValueError, TypeError, NotImplementedError):
+            pass
+    write_atomically(path_without_extension + '.pickle',
+                     lambda path: pd.to_pickle(value, path, protocol=pickle.HIGHEST_PROTOCOL))
+    return path_without_extension + '.pickle'
+
+
+# Entries computed from an older state of the source data can never be hit again. Returns the bytes removed.
+def invalidate_stale(prefix, fingerprint):
+    removed_bytes = 0
+    for path in glob.glob(glob.escape(prefix) + '*.p*'):
+        if not os.path.basename(path).startswith(os.path.basename(prefix) + fingerprint + '.'):
+            removed_bytes += os.path.getsize(path)
+            os.remove(path)
+            cache_stats['invalidations'] += 1
+    return removed_bytes
+
+
+def get_entries():
+    entries = list()
+    for path in glob.glob(os.path.join(glob.escape(cache_dir), '*')):
+        if path.endswith('.parquet') or path.endswith('.pickle'):
+            status = os.stat(path)
+            entries.append((status.st_mtime, status.st_size, path))
+    return sorted(entries)
+
+
+def get_cached_bytes():
+    if cache_dir not in cached_bytes:
+        cached_bytes[cache_dir] = sum(size for _, size, _ in get_entries())
+    return cached_bytes[cache_dir]
+
+
+def evict(max_bytes=None):
+    max_bytes = max_cache_bytes if max_bytes is None else max_bytes
+    entries = get_entries()
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+        cache_stats['evictions'] += 1
+    cached_bytes[cache_dir] = total_bytes
+
+
+# Returns (True, value) when a value is stored for the given name, parameters and fingerprint of the source data, and
+# (False, None) otherwise.
+def lookup(name, params=None, fingerprint=''):
+    path = find_entry(entry_prefix(name, params), fingerprint)
+    if path is None:
+        cache_stats['misses'] += 1
+        return False, None
+    cache_stats['hits'] += 1
+    # the modification time orders entries for eviction
+    os.utime(path)
+    return True, read_entry(path)
+
+
+# Whether a value is stored for the given name, parameters and fingerprint, without reading it
+def contains(name, params=None, fingerprint=''):
+    return find_entry(entry_prefix(name, params), fingerprint) is not None
+
+
+# Stores a value, replacing the ones stored for older states of the source data. Entries are evicted only once the
+# running total of this process goes over max_cache_bytes; the scan of evict then also takes in what other processes
+# stored meanwhile.
+def store(name, value, params=None, fingerprint=''):
+    prefix = entry_prefix(name, params)
+    total_bytes = get_cached_bytes()
+    if os.path.isdir(cache_dir):
+        total_bytes -= invalidate_stale(prefix, fingerprint)
+    total_bytes += os.path.getsize(write_entry(prefix + fingerprint, value))
+    cached_bytes[cache_dir] = total_bytes
+    if total_bytes > max_cache_bytes:
+        evict()
+
+
+# Returns the cached result of compute() for the given name, parameters and fingerprint of the source data, computing
+# and storing it on a miss.
+def get_or_compute(name, compute, params=None, fingerprint=''):
+    hit, value = lookup(name, params, fingerprint)
+    if not hit:
+        value = compute()
+        store(name, value, params, fingerprint)
+    return value
+
+
+def get_cache_stats():
+    entries = get_entries()
+    stats = dict(cache_stats)
+    stats['entries'] = len(entries)
+    stats['bytes'] = sum(size for _, size, _ in entries)
+    return stats
+
+
+def print_cache_stats():
+    stats = get_cache_stats()
+    print('Cache {}: {} hits, {} misses, {} invalidations, {} evictions, {} entries, {:.1f} MB'.format(
+        os.path.abspath(cache_dir), stats['hits'], stats['misses'], stats['invalidations'], stats['evictions'],
+        stats['entries'], stats['bytes'] / 1024 ** 2))
@@ -0,0 +1,66 @@
+import hashlib
+import os
+
+
+# Appends ';'-separated lines to a CSV file through one open handle, in batches of buffer_rows lines. The header is
+# only written to a new file, and with deduplicate a line already in the file (from this or an earlier run) is skipped.
+# Used as a context manager, it writes out what is buffered however the block is left, e.g. on KeyboardInterrupt.
+class CsvWriter(object):
+    def __init__(self, path, header=None, separator=';', buffer_rows=10000, deduplicate=True):
+        self.path = path
+        self.separator = separator
+        self.buffer_rows = buffer_rows
+        self.deduplicate = deduplicate
+        self.buffer = list()
+        self.seen = set()
+        self.written_rows = 0
+        self.skipped_rows = 0
+
+        exists = os.path.isfile(path)
+        if exists and deduplicate:
+            with open(path, 'r') as open_r:
+                for number, line in enumerate(open_r):
+                    if number > 0 or header is None:
+                        self.seen.add(self.line_digest(line.rstrip('\n')))
+        self.file = open(path, 'a')
+        if not exists and header is not None:
+            self.file.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def line_digest(line):
+        return hashlib.md5(line.encode('utf-8')).digest()
+
+    def write(self, values):
+        line = self.separator.join(values)
+        if self.deduplicate:
+            digest = self.line_digest(line)
+            if digest in self.seen:
+                self.skipped_rows += 1
+                return False
+            self.seen.add(digest)
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+        return True
+
+    # Lines are written as '\n' + line, so the file does not end with a newline, like the scripts always did
+    def flush(self):
+        if self.buffer:
+            self.file.write(''.join('\n' + line for line in self.buffer))
+            self.file.flush()
+            self.written_rows += len(self.buffer)
+            self.buffer = list()
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.file.close()
@@ -1,153 +1,347 @@
 import pandas as pd
-from sqlalchemy import create_engine
+import numpy as np
 import sys
-import re
-from numpy import std, mean, sqrt
+import hashlib
+import inspect
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from git import Repo
 
-
-def get_db_connection():
-    username = 'root'
-    password = 'passwd'
-    database_name = 'refactoring_analysis'
-    server = '127.0.0.1'
-
-    with open("../database.properties", 'r') as db_file:
-        for line in db_file:
-            line = line.strip()
-            username_search = re.search('^development.username=(.*)$', line, re.IGNORECASE)
-            password_search = re.search('^development.password=(.*)$', line, re.IGNORECASE)
-            url_search = re.search('^development.url=jdbc:mysql://(.*)/(.*)$', line, re.IGNORECASE)
-
-            if username_search:
-                username = username_search.group(1)
-            if password_search:
-                password = password_search.group(1)
-            if url_search:
-                server = url_search.group(1)
-                database_name = url_search.group(2)
-
-    return create_engine('mysql+pymysql://{}:{}@{}/{}'.format(username, password, server, database_name))
+import cache
+from cache import digest, get_or_compute
+import database
+import effect_size
+from database import compact_schemas, get_engine, get_table_state, iter_groups, read_query, read_table, stream_table, \
+    streaming_order
+from encoding import align_frames, compact_frame, shrink_categories
+from csv_writer import CsvWriter
+from refactoring_types import get_sql_condition, get_type_filter, get_types, get_types_key, read_accepted_regions, \
+    stream_accepted_regions
+from lookup import index_involved_refactorings, index_merge_commits
+from merge_bases import git_repositories, resolve_merge_bases
+import parallel
+from parallel import get_executor
+from incremental import map_projects_incrementally, project_filter
+import instrumentation
+from instrumentation import per_project, stage, timed
+from involvement import join_involved, involvement_crh_columns, involvement_rr_columns, region_columns
 
 
-def regions_intersect(region_1_start, region_1_length, region_2_start, region_2_length):
-    if region_1_start + region_1_length < region_2_start:
-        return False
-    elif region_2_start + region_2_length < region_1_start:
-        return False
-    return True
-
-
-def record_involved(x):
-    is_source = (x['type'] == 's' and
-                 x['old_path'] == x['path'] and
-                 regions_intersect(x['old_start_line'], x['old_length'], x['start_line'], x['length']))
-    is_dest = (x['type'] == 'd' and
-               x['new_path'] == x['path'] and
-               regions_intersect(x['new_start_line'], x['new_length'], x['start_line'], x['length']))
-    return is_source or is_dest
-
-
-accepted_types = ['Change Package', 'Extract And Move Method', 'Extract Interface', 'Extract Method',
-                  'Extract Superclass', 'Inline Method', 'Move And Rename Class', 'Move Attribute', 'Move Class',
-                  'Move Method', 'Pull Up Attribute', 'Pull Up Method', 'Pull Up Method', 'Push Down Method',
-                  'Rename Class', 'Rename Method']
+def get_db_connection():
+    return get_engine()
 
 
 def get_refactoring_types_sql_condition():
-    type_condition = str()
-    for ref_type in accepted_types:
-        type_condition += 'refactoring_type = \"{}\" or '.format(ref_type)
-    return type_condition[:-4]
+    return get_sql_condition()
 
 
-def read_sql_table(table):
+def read_sql_table(table, columns=None, filters=None, compact=False):
     print('Reading table {} from the database'.format(table))
-    query = 'SELECT * FROM ' + table
-    df = pd.read_sql(query, get_db_connection())
-    return df
+    return read_table(table, columns, filters, compact=compact)
 
 
-def get_merge_commits():
-    return read_sql_table('merge_commit')
+# Rows of a table ordered by project and commit (or order_by), chunk by chunk through a server-side cursor
+def stream_sql_table(table, columns=None, filters=None, compact=False, order_by=streaming_order):
+    print('Streaming table {} from the database'.format(table))
+    return stream_table(table, columns, filters, order_by, compact=compact)
 
 
-def get_merge_commits_of(project_id):
-    print('Reading table {} from the database'.format('merge_commit'))
-    query = 'SELECT * FROM ' + 'merge_commit' + ' WHERE project_id=' + project_id
-    df = pd.read_sql(query, get_db_connection())
-    return df
+merge_scenario_columns = ['id', 'project_id', 'commit_hash', 'parent_1', 'parent_2']
+# header of the merge scenario CSVs
+# merge_scenario_header = 'ref_type;ref_detail;commit_hash;merge_parent;merge_commit;parent_1;parent_2;merge_base'
+merge_scenario_header = 'merge_parent;merge_commit;parent1;parent2;merge_base;ref_type;ref_detail;old_path;' \
+                        'old_start_line;new_path;new_start_line'
 
 
-def get_conflicting_regions():
-    return read_sql_table('conflicting_region')
+def get_merge_commits(columns=None, filters=None):
+    return read_sql_table('merge_commit', columns, filters)
 
 
-def get_conflicting_region_histories():
-    return read_sql_table('conflicting_region_history')
+def get_merge_commits_of(project_id, columns=None):
+    return read_sql_table('merge_commit', columns, [('project_id', '=', int(project_id))])
 
 
-def get_conflicting_region_history_of(project_id):
-    print('Reading table {} from the database'.format('conflicting_region_history'))
-    query = 'SELECT * FROM ' + 'conflicting_region_history' + ' WHERE project_id=' + project_id
-    df = pd.read_sql(query, get_db_connection())
-    return df
-
+def get_conflicting_regions(columns=None):
+    return read_sql_table('conflicting_region', columns)
 
-def get_refactorings():
-    return read_sql_table('refactoring')
 
+def get_conflicting_region_histories(columns=None, compact=False, filters=None):
+    return read_sql_table('conflicting_region_history', columns, filters, compact)
 
-def get_accepted_refactorings():
-    query = 'select * from refactoring where ({})'.format(get_refactoring_types_sql_condition())
-    return pd.read_sql(query, get_db_connection())
 
+def get_conflicting_region_history_of(project_id, columns=None):
+    return read_sql_table('conflicting_region_history', columns, [('project_id', '=', int(project_id))])
 
-def get_accepted_refactorings_of(project_id):
-    query = 'select * from refactoring where ({})'.format(
-        get_refactoring_types_sql_condition()) + ' AND project_id=' + project_id
-    return pd.read_sql(query, get_db_connection())
 
+def get_refactorings(columns=None):
+    return read_sql_table('refactoring', columns)
 
-def get_refactoring_regions():
-    return read_sql_table('refactoring_region')
 
+def get_accepted_refactorings(columns=None, filters=None):
+    return read_sql_table('refactoring', columns, get_type_filter() + (filters or []))
 
-def get_accepted_refactoring_regions():
-    print('Reading table refactoring_region from the database')
 
-    query = 'select * from refactoring_region where refactoring_id in (select id from refactoring where ({}))' \
-        .format(get_refactoring_types_sql_condition())
-    return pd.read_sql(query, get_db_connection())
+def get_accepted_refactorings_of(project_id, columns=None):
+    return read_sql_table('refactoring', columns, get_type_filter() + [('project_id', '=', int(project_id))])
 
 
-def get_accepted_refactoring_regions_of(project_id):
-    print('Reading table refactoring_region from the database')
+def get_refactoring_regions(columns=None):
+    return read_sql_table('refactoring_region', columns)
 
-    query = 'select * from refactoring_region where refactoring_id in (select id from refactoring where ({}))' \
-                .format(get_refactoring_types_sql_condition()) + ' AND project_id=' + project_id
-    return pd.read_sql(query, get_db_connection())
 
+def get_accepted_refactoring_regions(columns=None, compact=False, filters=None):
+    print('Reading table refactoring_region from the database')
+    return read_accepted_regions(columns, filters, compact)
 
-def get_conflicting_regions_by_count_of_involved_refactoring():
-    conflicting_regions = get_conflicting_regions()
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
 
-    crs_with_involved_refs = pd.DataFrame()
+def get_accepted_refactoring_regions_of(project_id, columns=None):
+    print('Reading table refactoring_region from the database')
+    return read_accepted_regions(columns, [('project_id', '=', int(project_id))])
+
+
+# Identifies the state of the given tables (row count and max id) together with the accepted refactoring types, so
+# that anything derived from them can be stored per database snapshot.
+def get_tables_fingerprint(tables):
+    state = [get_types_key()] + [get_table_state(table) for table in sorted(set(tables))]
+    return hashlib.sha1('\n'.join(state).encode('utf-8')).hexdigest()[:16]
+
+
+analysis_tables = ['merge_commit', 'conflicting_region', 'conflicting_region_history', 'refactoring',
+                   'refactoring_region']
+involvement_tables = ['conflicting_region_history', 'refactoring', 'refactoring_region']
+involvement_by_fingerprint = dict()
+# 'pandas' joins the tables in the analysis process, 'sql' has MySQL compute the involved pairs (see indexes.sql)
+involvement_join = os.environ.get('ANALYSIS_INVOLVEMENT_JOIN', 'pandas')
+# Load the tables of the pandas join in their compact representation (shared dictionaries, categoricals, int32 lines)
+compact_involvement = os.environ.get('ANALYSIS_COMPACT', '1') != '0'
+# In streaming mode, conflicting region histories of a project are joined this many rows (whole commits) at a time
+involvement_batch_rows = int(os.environ.get('ANALYSIS_STREAMING_BATCH_ROWS', '50000'))
+
+
+# (project id, rows of the project) for the given projects in order, with no rows for a project the frame does not
+# have, or for all projects of the frame for None
+def group_by_project(df, project_ids=None):
+    grouped = df.groupby('project_id')
+    for project_id in sorted(grouped.groups) if project_ids is None else project_ids:
+        yield project_id, grouped.get_group(project_id) if project_id in grouped.groups else df.iloc[:0]
+
+
+# The rows of one project at a time from (project id, rows) pairs in order of project id, for projects asked for in
+# increasing order
+class ProjectStream(object):
+    def __init__(self, groups):
+        self.groups = iter(groups)
+        self.current = next(self.groups, None)
+
+    def get(self, project_id):
+        while self.current is not None and self.current[0] < project_id:
+            self.current = next(self.groups, None)
+        if self.current is not None and self.current[0] == project_id:
+            return self.current[1]
+        return None
+
+
+# group_by_project for chunks of rows ordered by project (see database.stream_table): only one project is in memory
+# at a time. A project without rows gets an empty frame of the given columns.
+def stream_by_project(chunks, schema=None, project_ids=None, columns=None):
+    groups = iter_groups(chunks, 'project_id', schema)
+    if project_ids is None:
+        yield from groups
+        return
+    stream = ProjectStream(groups)
+    for project_id in project_ids:
+        rows = stream.get(project_id)
+        yield project_id, rows if rows is not None else pd.DataFrame(columns=columns)
+
+
+# The involved (conflicting_region_history, refactoring_region) pairs of every project, along with the ids of the
+# projects that have both conflicting region histories and accepted refactoring regions. In incremental mode the pairs
+# are stored per project, and only projects whose rows changed are joined again.
+@timed
+def materialize_involvement():
+    partials = map_projects_incrementally('involvement_of_project', involve_project, 'conflicting_region_history',
+                                          involvement_tables, involvement_tasks, get_types_key())
+    project_ids = [project_id for project_id, involved in partials if involved is not None]
+    involved_crh_rr = [involved for project_id, involved in partials if involved is not None]
+    if not involved_crh_rr:
+        involved_crh_rr = [join_involved(pd.DataFrame(columns=['index'] + involvement_crh_columns),
+                                         pd.DataFrame(columns=['index'] + involvement_rr_columns))]
+
+    involved_crh_rr = pd.concat(involved_crh_rr, ignore_index=True)
+    if compact_involvement:
+        involved_crh_rr = shrink_categories(compact_frame(involved_crh_rr, compact_schemas['involvement']))
+    return involved_crh_rr, project_ids
+
+
+# One task per project with conflicting region histories; projects without accepted refactoring regions get None
+@timed
+def involvement_tasks(project_ids):
+    if database.streaming:
+        return involvement_tasks_streamed(project_ids)
+    conflicting_region_histories = get_conflicting_region_histories(involvement_crh_columns, compact_involvement,
+                                                                    project_filter(project_ids))
+    refactoring_regions = get_accepted_refactoring_regions(involvement_rr_columns, compact_involvement,
+                                                           project_filter(project_ids))
+    if compact_involvement:
+        align_frames([conflicting_region_histories], compact_schemas['conflicting_region_history'])
+
+    tasks = list()
     rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
+    for project_id, project_crh in group_by_project(conflicting_region_histories, project_ids):
         if project_id not in rr_grouped_by_project.groups:
+            tasks.append((project_id, None, None))
             continue
         project_rrs = rr_grouped_by_project.get_group(project_id)
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        crh_with_involved_refs = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-        crs_with_involved_refs = crs_with_involved_refs.append(
-            crh_with_involved_refs.groupby('conflicting_region_id').size().to_frame())
+        if compact_involvement and parallel.workers > 1:
+            # a project only takes the part of the shared dictionaries it uses to the worker processes
+            project_crh, project_rrs = shrink_categories(project_crh), shrink_categories(project_rrs)
+        tasks.append((project_id, project_crh, project_rrs))
+    return tasks
+
+
+# involvement_tasks with the tables streamed in order of project and commit, loading one project at a time
+def involvement_tasks_streamed(project_ids):
+    crh_schema = compact_schemas['conflicting_region_history'] if compact_involvement else None
+    rr_schema = compact_schemas['refactoring_region'] if compact_involvement else None
+    conflicting_region_histories = stream_by_project(
+        stream_sql_table('conflicting_region_history', involvement_crh_columns, project_filter(project_ids),
+                         compact_involvement), crh_schema, project_ids, involvement_crh_columns)
+    print('Streaming table refactoring_region from the database')
+    refactoring_regions = ProjectStream(iter_groups(
+        stream_accepted_regions(involvement_rr_columns, project_filter(project_ids), compact_involvement),
+        'project_id', rr_schema))
+    for project_id, project_crh in conflicting_region_histories:
+        project_rrs = refactoring_regions.get(project_id)
+        if project_rrs is None:
+            yield project_id, None, None
+            continue
+        if compact_involvement:
+            # coded over the dictionaries as they were when each was read
+            align_frames([project_crh], crh_schema)
+            align_frames([project_rrs], rr_schema)
+            if parallel.workers > 1:
+                project_crh, project_rrs = shrink_categories(project_crh), shrink_categories(project_rrs)
+        yield project_id, project_crh, project_rrs
+
+
+# Consecutive rows of conflicting region histories ordered by commit, cut between commits every batch_rows rows
+def commit_batches(crh, batch_rows):
+    commits = crh['commit_hash'].to_numpy()
+    cuts = [0]
+    for start in np.flatnonzero(commits[1:] != commits[:-1]) + 1:
+        if start - cuts[-1] >= batch_rows:
+            cuts.append(start)
+    cuts.append(len(crh))
+    return [crh.iloc[start:end] for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+@per_project
+def involve_project(project_id, project_crh, project_rrs):
+    if project_rrs is None:
+        return None
+    print('Processing project {}'.format(project_id))
+    if not database.streaming or len(project_crh) <= involvement_batch_rows:
+        return join_involved(project_crh.reset_index(), project_rrs.reset_index())
+    # streamed rows come ordered by commit: join a batch of commits at a time to bound the candidate pairs
+    project_rrs = project_rrs.reset_index()
+    return pd.concat([join_involved(batch.reset_index(), project_rrs[project_rrs['commit_hash'].isin(
+        batch['commit_hash'].unique())]) for batch in commit_batches(project_crh, involvement_batch_rows)],
+                     ignore_index=True)
+
+
+def involvement_select_list():
+    crh_columns = ['crh.{0} as {0}_x'.format(column) if column in involvement_rr_columns and column != 'commit_hash'
+                   else 'crh.' + column for column in involvement_crh_columns]
+    rr_columns = ['rr.{0} as {0}_y'.format(column) if column in involvement_crh_columns else 'rr.' + column
+                  for column in involvement_rr_columns if column != 'commit_hash']
+    return ', '.join(crh_columns + rr_columns)
+
+
+# The involvement test of involvement.join_involved as a join condition. NULL paths match each other and a NULL line
+# number counts as intersecting, like in the pandas join.
+def involvement_sql_condition(region_type, path_column, start_column, length_column):
+    return ("rr.type = '{0}' and (rr.path = crh.{1} or (rr.path is null and crh.{1} is null)) and "
+            "coalesce(crh.{2} + crh.{3} < rr.start_line, 0) = 0 and "
+            "coalesce(rr.start_line + rr.length < crh.{2}, 0) = 0").format(
+        region_type, path_column, start_column, length_column)
+
+
+# Same pairs as materialize_involvement, computed by the database so that only the involved pairs are transferred.
+# The rows come ordered by project and ids, and without the index_x and index_y positions of the pandas join.
+@timed
+def materialize_involvement_sql():
+    print('Joining conflicting region histories and refactoring regions in the database')
+    accepted = 'join refactoring r on r.id = rr.refactoring_id and r.refactoring_type in :types'
+    query = 'select {} from conflicting_region_history crh join refactoring_region rr on ' \
+            'rr.project_id = crh.project_id and rr.commit_hash = crh.commit_hash {} where {} ' \
+            'order by crh.project_id, crh.id, rr.id'.format(
+                involvement_select_list(), accepted,
+                ' or '.join('(' + involvement_sql_condition(*columns) + ')' for columns in region_columns))
+    involved_crh_rr = read_query(query, 'involvement', {'types': get_types()})
+
+    project_ids = read_query('select distinct crh.project_id from conflicting_region_history crh where exists '
+                             '(select 1 from refactoring_region rr {} where rr.project_id = crh.project_id) '
+                             'order by crh.project_id'.format(accepted), 'conflicting_region_history',
+                             {'types': get_types()})['project_id'].tolist()
+    return involved_crh_rr, project_ids
+
+
+# The join that computes the involvement relation, the parameters it is cached with and the fingerprint of its tables
+def get_involvement_entry():
+    # the snapshot backend has no database to run the join in
+    join = 'pandas' if database.backend == 'snapshot' else involvement_join
+    return join, {'join': 'sql'} if join == 'sql' else None, get_tables_fingerprint(involvement_tables)
+
+
+def is_involvement_cached():
+    _, params, fingerprint = get_involvement_entry()
+    return cache.contains('involvement', params, fingerprint) and \
+        cache.contains('involvement_projects', params, fingerprint)
+
+
+# The involved pairs and the projects they were computed for are cached as two data frames, so that the large one is
+# stored as Parquet
+def get_cached_involvement(materialize, params, fingerprint):
+    hit, involved_crh_rr = cache.lookup('involvement', params, fingerprint)
+    projects_hit, projects = cache.lookup('involvement_projects', params, fingerprint)
+    if hit and projects_hit:
+        return involved_crh_rr, projects['project_id'].tolist()
+    involved_crh_rr, project_ids = materialize()
+    cache.store('involvement', involved_crh_rr, params, fingerprint)
+    cache.store('involvement_projects', pd.DataFrame({'project_id': project_ids}, dtype='int64'), params, fingerprint)
+    return involved_crh_rr, project_ids
+
+
+# Builds the involvement relation once per database snapshot and shares it between all the analyses
+def get_involvement():
+    join, params, fingerprint = get_involvement_entry()
+    if (join, fingerprint) not in involvement_by_fingerprint:
+        materialize = materialize_involvement_sql if join == 'sql' else materialize_involvement
+        involvement_by_fingerprint[(join, fingerprint)] = get_cached_involvement(materialize, params, fingerprint)
+    return involvement_by_fingerprint[(join, fingerprint)]
+
+
+def get_involved_crh_rr():
+    return get_involvement()[0]
+
+
+def get_involved_crh_rr_by_project():
+    involved_crh_rr, project_ids = get_involvement()
+    involved_by_project = involved_crh_rr.groupby('project_id_x')
+    for project_id in project_ids:
+        if project_id in involved_by_project.groups:
+            yield project_id, involved_by_project.get_group(project_id)
+        else:
+            yield project_id, involved_crh_rr.iloc[:0]
+
+
+def get_conflicting_regions_by_count_of_involved_refactoring():
+    conflicting_regions = get_conflicting_regions(['id', 'parent_1_length', 'parent_2_length'])
+    crh_with_involved_refs = get_involved_crh_rr()
+
+    crs_with_involved_refs = crh_with_involved_refs.groupby('conflicting_region_id').size().to_frame()
 
     crs_by_involved_refs = conflicting_regions[['id']]
     # The +2 is because length is actually the difference between the start and end line of the code range. So the
@@ -161,23 +355,10 @@ def get_conflicting_regions_by_count_of_involved_refactoring():
 
 
 def get_conflicting_region_size_by_involved_refactoring_size():
-    conflicting_regions = get_conflicting_regions()
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
+    conflicting_regions = get_conflicting_regions(['id', 'parent_1_length', 'parent_2_length'])
+    crh_with_involved_refs = get_involved_crh_rr()
 
-    crs_with_involved_refs_size = pd.DataFrame()
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
-        if project_id not in rr_grouped_by_project.groups:
-            continue
-        project_rrs = rr_grouped_by_project.get_group(project_id)
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        crh_with_involved_refs = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-        crs_with_involved_refs_size = crs_with_involved_refs_size.append(
-            crh_with_involved_refs.groupby('conflicting_region_id').length.sum().to_frame())
+    crs_with_involved_refs_size = crh_with_involved_refs.groupby('conflicting_region_id').length.sum().to_frame()
 
     crs_with_involved_refs_size.rename(columns={'length': 'refactoring_size'}, inplace=True)
     crs_by_size = conflicting_regions[['id']]
@@ -193,93 +374,120 @@ def get_conflicting_region_size_by_involved_refactoring_size():
 
 
 def get_conflicting_merge_commit_by_merge_author_involvement_in_conflict():
-    merge_commits = get_merge_commits()[['id', 'author_email']].rename(columns={'author_email': 'merge_author_email'})
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
-
     mc_by_author_involvement = pd.DataFrame()
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
-
-        commits_with_involved_refs = pd.DataFrame(columns={'commit_hash'})
-        if project_id in rr_grouped_by_project.groups:
-            project_rrs = rr_grouped_by_project.get_group(project_id)
-            crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash',
-                                       how='inner')
-            crh_with_involved_refs = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-            commits_with_involved_refs = pd.DataFrame(crh_with_involved_refs.commit_hash.unique()).rename(
-                columns={0: 'commit_hash'})
-
-        crh_mc = project_crh.merge(merge_commits, how='inner', left_on='merge_commit_id', right_on='id')
-        crh_mc_same_author = crh_mc[crh_mc['author_email'] == crh_mc['merge_author_email']]
-        crh_mc_same_author_with_involved_ref = crh_mc_same_author.merge(commits_with_involved_refs, how='inner',
-                                                                        on='commit_hash')
-        crh_mc_with_involved_ref = crh_mc.merge(commits_with_involved_refs, how='inner', on='commit_hash')
-
-        crh_mc_count = crh_mc.groupby('merge_commit_id').commit_hash.nunique().to_frame().rename(
-            columns={'commit_hash': 'total_crh'})
-        crh_mc_same_author_count = crh_mc_same_author.groupby(
-            'merge_commit_id').commit_hash.nunique().to_frame().rename(columns={'commit_hash': 'crh_merge_author'})
-        crh_mc_same_author_with_involved_ref_count = crh_mc_same_author_with_involved_ref.groupby(
-            'merge_commit_id').commit_hash.nunique().to_frame().rename(
-            columns={'commit_hash': 'crh_merge_author_involved_ref'})
-        crh_mc_with_involved_ref_count = crh_mc_with_involved_ref.groupby(
-            'merge_commit_id').commit_hash.nunique().to_frame().rename(columns={'commit_hash': 'crh_involved_ref'})
-        crh_mc_involvement = crh_mc_count.join(crh_mc_same_author_count, how='outer').join(
-            crh_mc_with_involved_ref_count, how='outer').join(crh_mc_same_author_with_involved_ref_count,
-                                                              how='outer').fillna(0).astype(int).reset_index()
-        crh_mc_involvement['project_id'] = project_id
-
+    for project_id, crh_mc_involvement in map_projects_incrementally(
+            'merge_author_involvement_of_project', merge_author_involvement_of, 'conflicting_region_history',
+            frame_sources['conflicting_merge_commit_by_merge_author_involvement_in_conflict'],
+            merge_author_involvement_tasks, get_types_key()):
         mc_by_author_involvement = mc_by_author_involvement.append(crh_mc_involvement)
 
     return mc_by_author_involvement
 
 
+@timed
+def merge_author_involvement_tasks(project_ids):
+    if database.streaming:
+        return merge_author_involvement_tasks_streamed(project_ids)
+    merge_commits = get_merge_commits(['id', 'project_id', 'author_email'], project_filter(project_ids)).rename(
+        columns={'author_email': 'merge_author_email'})
+    conflicting_region_histories = get_conflicting_region_histories(
+        ['project_id', 'merge_commit_id', 'commit_hash', 'author_email'], filters=project_filter(project_ids))
+    involved_by_project = dict(get_involved_crh_rr_by_project())
+
+    tasks = list()
+    mc_grouped_by_project = merge_commits.groupby('project_id')
+    for project_id, project_crh in group_by_project(conflicting_region_histories, project_ids):
+        project_mcs = merge_commits.iloc[:0]
+        if project_id in mc_grouped_by_project.groups:
+            project_mcs = mc_grouped_by_project.get_group(project_id)
+        tasks.append((project_id, project_crh, project_mcs.drop(columns='project_id'),
+                      involved_by_project.get(project_id)))
+    return tasks
+
+
+def merge_author_involvement_tasks_streamed(project_ids):
+    crh_columns = ['project_id', 'merge_commit_id', 'commit_hash', 'author_email']
+    conflicting_region_histories = stream_by_project(stream_sql_table(
+        'conflicting_region_history', crh_columns, project_filter(project_ids)), None, project_ids, crh_columns)
+    merge_commits = ProjectStream(iter_groups(stream_sql_table(
+        'merge_commit', ['id', 'project_id', 'author_email'], project_filter(project_ids), order_by=('project_id', 'id')),
+        'project_id'))
+    involved_by_project = dict(get_involved_crh_rr_by_project())
+    for project_id, project_crh in conflicting_region_histories:
+        project_mcs = merge_commits.get(project_id)
+        if project_mcs is None:
+            project_mcs = pd.DataFrame(columns=['id', 'project_id', 'author_email'])
+        yield (project_id, project_crh, project_mcs.drop(columns='project_id').rename(
+            columns={'author_email': 'merge_author_email'}), involved_by_project.get(project_id))
+
+
+@per_project
+def merge_author_involvement_of(project_id, project_crh, merge_commits, crh_with_involved_refs):
+    print('Processing project {}'.format(project_id))
+
+    commits_with_involved_refs = pd.DataFrame(columns={'commit_hash'})
+    if crh_with_involved_refs is not None:
+        commits_with_involved_refs = pd.DataFrame(crh_with_involved_refs.commit_hash.unique()).rename(
+            columns={0: 'commit_hash'})
+
+    crh_mc = project_crh.merge(merge_commits, how='inner', left_on='merge_commit_id', right_on='id')
+    crh_mc_same_author = crh_mc[crh_mc['author_email'] == crh_mc['merge_author_email']]
+    crh_mc_same_author_with_involved_ref = crh_mc_same_author.merge(commits_with_involved_refs, how='inner',
+                                                                    on='commit_hash')
+    crh_mc_with_involved_ref = crh_mc.merge(commits_with_involved_refs, how='inner', on='commit_hash')
+
+    crh_mc_count = crh_mc.groupby('merge_commit_id').commit_hash.nunique().to_frame().rename(
+        columns={'commit_hash': 'total_crh'})
+    crh_mc_same_author_count = crh_mc_same_author.groupby(
+        'merge_commit_id').commit_hash.nunique().to_frame().rename(columns={'commit_hash': 'crh_merge_author'})
+    crh_mc_same_author_with_involved_ref_count = crh_mc_same_author_with_involved_ref.groupby(
+        'merge_commit_id').commit_hash.nunique().to_frame().rename(
+        columns={'commit_hash': 'crh_merge_author_involved_ref'})
+    crh_mc_with_involved_ref_count = crh_mc_with_involved_ref.groupby(
+        'merge_commit_id').commit_hash.nunique().to_frame().rename(columns={'commit_hash': 'crh_involved_ref'})
+    crh_mc_involvement = crh_mc_count.join(crh_mc_same_author_count, how='outer').join(
+        crh_mc_with_involved_ref_count, how='outer').join(crh_mc_same_author_with_involved_ref_count,
+                                                          how='outer').fillna(0).astype(int).reset_index()
+    crh_mc_involvement['project_id'] = project_id
+    return crh_mc_involvement
+
+
 # 20190310
 def get_involved_refactorings_by_refactoring_type():
-    conflicting_region_histories = get_conflicting_region_histories()
     refactorings = get_accepted_refactorings()
-    refactoring_regions = get_accepted_refactoring_regions()
-    merge_commits = get_merge_commits()
+    merge_commit_index = index_merge_commits(get_merge_commits(merge_scenario_columns))
     repo_paths = [
         'D:\\github\\repos\\javaparser',
         'D:\\github\\repos\\junit5'
     ]
 
     involved_refs_count_per_project = pd.DataFrame()
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
     counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
+    for project_id, involved_crh_rr in get_involved_crh_rr_by_project():
         counter += 1
         print('Processing project {}'.format(counter))
 
         repo = Repo(repo_paths[counter - 1])
         path = 'merge_scenarios_by_ref_type_' + str(project_id) + '.csv'
 
-        if project_id not in rr_grouped_by_project.groups:
-            continue
-        project_rrs = rr_grouped_by_project.get_group(project_id)
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        involved_crh_rr = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
         involved_refactorings = refactorings[refactorings['id'].isin(involved_crh_rr['refactoring_id'])]
+        involved_refactoring_index = index_involved_refactorings(involved_crh_rr)
+        merge_bases = resolve_project_merge_bases(repo, project_id, merge_commit_index,
+                                                  involved_crh_rr['merge_commit_id'].unique())
         # involved_ref_per_type = involved_refactorings.groupby('refactoring_type').id.nunique().to_frame().rename(
         #     columns={'id': 'involved_refs_count'})
-        for index, group in involved_refactorings.groupby('refactoring_type'):
-            for _, row in group.iterrows():
-                line = []
-                line.append(row['refactoring_type'])
-                line.append(row['refactoring_detail'])
-                line.append(row['commit_hash'])
-                crh_rr = involved_crh_rr[(involved_crh_rr['project_id_x'] == row['project_id']) & (
-                            involved_crh_rr['refactoring_id'] == row['id'])]
-                line.append(str(crh_rr['merge_parent'].iloc[0]))
-                merge_commit_id = crh_rr['merge_commit_id'].iloc[0]
-                line.append(";".join(get_merge_scenario(repo, project_id, merge_commits, merge_commit_id)))
-
-                print_to_csv(path, line)
+        with CsvWriter(path, merge_scenario_header) as writer:
+            for index, group in involved_refactorings.groupby('refactoring_type'):
+                for _, row in group.iterrows():
+                    line = []
+                    line.append(row['refactoring_type'])
+                    line.append(row['refactoring_detail'])
+                    line.append(row['commit_hash'])
+                    merge_parent, merge_commit_id = involved_refactoring_index[(row['project_id'], row['id'])]
+                    line.append(str(merge_parent))
+                    line.append(";".join(get_merge_scenario(merge_bases, project_id, merge_commit_index, merge_commit_id)))
+
+                    writer.write(line)
         # for refactoring_index in involved_ref_per_type.index:
         #     if refactoring_index not in accepted_types:
         #         involved_ref_per_type = involved_ref_per_type.drop(refactoring_index)
@@ -295,144 +503,187 @@ def get_involved_refactorings_by_refactoring_type():
 # 20190310
 
 
-def get_refactorings_by_refactoring_type():
-    refactorings = get_accepted_refactorings()
+# The number of accepted refactorings of every type in every project, in one pass over the refactorings, and with
+# involved_ids, how many of them are involved in a conflicting region: project_id, refactoring_type, overall[, involved]
+def count_refactoring_types(refactorings, involved_ids=None):
+    keys = [refactorings['project_id'], refactorings['refactoring_type']]
+    counts = refactorings.groupby(keys, observed=True).size().rename('overall').to_frame()
+    if involved_ids is not None:
+        counts['involved'] = refactorings['id'].isin(involved_ids).groupby(keys, observed=True).sum().astype(int)
+    return counts.reset_index()
 
-    refactorings_count_per_project = pd.DataFrame()
-    counter = 0
-    for project_id, project_refactorings in refactorings.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
 
-        refactorings_per_type = project_refactorings.groupby('refactoring_type').id.nunique().to_frame().rename(
-            columns={'id': 'refs_count'})
+# Project x refactoring type matrix of a column of count_refactoring_types, with the share of every type in the
+# refactorings of the project for share=True. Types a project has none of are NaN, and projects without any are left
+# out. Projects are named by their id as a string.
+def refactoring_type_matrix(counts, column='overall', share=False):
+    counts = counts[counts[column] > 0]
+    matrix = counts.pivot(index='project_id', columns='refactoring_type', values=column)
+    if share:
+        matrix = matrix.div(matrix.sum(axis=1), axis=0)
+    matrix.index = matrix.index.astype(str)
+    matrix.index.name = None
+    return matrix
 
-        # for refactoring_index in refactorings_per_type.index:
-        #     if refactoring_index not in accepted_types:
-        #         refactorings_per_type = refactorings_per_type.drop(refactoring_index)
 
-        refactorings_per_type['refs_count'] = refactorings_per_type['refs_count'] / sum(
-            refactorings_per_type['refs_count'])
-        refactorings_per_type.rename(columns={'refs_count': str(project_id)}, inplace=True)
-        refactorings_count_per_project = refactorings_count_per_project.append(refactorings_per_type.T)
+# The shares of every refactoring type in every project, as one column per project
+def get_refactorings_by_refactoring_type():
+    counts = count_refactoring_types(get_accepted_refactorings(['id', 'project_id', 'refactoring_type']))
+    return refactoring_type_matrix(counts, share=True).T
 
-    return refactorings_count_per_project.T
 
+def get_refactoring_type_counts():
+    refactorings = get_accepted_refactorings(['id', 'project_id', 'refactoring_type'])
+    return count_refactoring_types(refactorings, get_involved_crh_rr()['refactoring_id'].unique())
 
+
+# The share of every refactoring type in the refactorings (overall) and in the involved refactorings (involved) of every
+# project with refactorings, 0 for the types a project has none of
 def get_refactorings_by_refactoring_type_split_by_involved():
-    all_refs = get_data_frame('refactorings_by_refactoring_type').fillna(0).T
-    involved_refs = get_data_frame('involved_refactorings_by_refactoring_type').fillna(0).T
-
-    plot_df = pd.DataFrame(columns=['project_id', 'refactoring_type', 'percent', 'overall_or_involved'])
-    for project_id in all_refs.index:
-        for refactoring_type in all_refs.loc[project_id].index:
-            overall_percent = all_refs.loc[project_id].loc[refactoring_type]
-            plot_df = plot_df.append({'project_id': project_id, 'refactoring_type': refactoring_type,
-                                      'percent': overall_percent, 'overall_or_involved': 'overall'},
-                                     ignore_index=True)
-            try:
-                involved_percent = involved_refs.loc[project_id].loc[refactoring_type]
-            except KeyError:
-                involved_percent = 0.
-
-            plot_df = plot_df.append({'project_id': project_id, 'refactoring_type': refactoring_type,
-                                      'percent': involved_percent, 'overall_or_involved': 'involved'},
-                                     ignore_index=True)
-    return plot_df
+    counts = get_data_frame('refactoring_type_counts')
+    all_refs = refactoring_type_matrix(counts, share=True).fillna(0)
+    involved_refs = refactoring_type_matrix(counts, 'involved', share=True).reindex_like(all_refs).fillna(0)
+
+    plot_df = pd.concat([all_refs.stack().rename('overall'), involved_refs.stack().rename('involved')], axis=1)
+    plot_df.columns.name = 'overall_or_involved'
+    plot_df = plot_df.stack().rename('percent').reset_index()
+    plot_df.columns = ['project_id', 'refactoring_type', 'overall_or_involved', 'percent']
+    return plot_df[['project_id', 'refactoring_type', 'percent', 'overall_or_involved']]
 
 
 def get_conflicting_regions_by_involved_refactorings_per_merge_commit():
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
+    conflicting_region_histories = get_conflicting_region_histories(['merge_commit_id', 'conflicting_region_id'])
+    involved = get_involved_crh_rr()
 
     cr_count_per_merge = conflicting_region_histories.groupby(
         'merge_commit_id').conflicting_region_id.nunique().to_frame().rename(
         columns={'conflicting_region_id': 'cr_count'})
 
-    involved_cr_count_per_merge = pd.DataFrame()
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
-        if project_id not in rr_grouped_by_project.groups:
-            continue
-        project_rrs = rr_grouped_by_project.get_group(project_id)
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        involved = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-        involved_cr_count_per_merge = involved_cr_count_per_merge.append(
-            involved.groupby('merge_commit_id').conflicting_region_id.nunique().to_frame().rename(
-                columns={'conflicting_region_id': 'involved_cr_count'}))
+    involved_cr_count_per_merge = involved.groupby('merge_commit_id').conflicting_region_id.nunique().to_frame().rename(
+        columns={'conflicting_region_id': 'involved_cr_count'})
 
     rq1_table = cr_count_per_merge.join(involved_cr_count_per_merge, how='outer').fillna(0).astype(int)
     rq1_table['percent'] = rq1_table['involved_cr_count'] / rq1_table['cr_count']
     return rq1_table
 
 
-# analyze data generated in MySql database by https://github.com/Symbolk/RefactoringsInMergeCommits
-def get_merge_scenarios_involved_refactorings():
-    # process one project each time
-    repo_id = "7"
-    repo_name = "storm"
-    repo_paths = [
-        'D:\\github\\repos\\'+repo_name
-    ]
-    csv_path = 'merge_scenarios_involved_refactorings_' + repo_name + '.csv'
+# Clones of the projects, by project id, to extract the merge scenarios from
+default_repo_paths = {
+    7: 'D:\\github\\repos\\storm',
+}
 
-    conflicting_region_histories = get_conflicting_region_history_of(repo_id)
-    refactorings = get_accepted_refactorings_of(repo_id)
-    refactoring_regions = get_accepted_refactoring_regions_of(repo_id)
-    merge_commits = get_merge_commits_of(repo_id)
 
-    refs_grouped_by_project = refactorings.groupby('project_id')
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(project_id))
+# Reads a project id -> clone path mapping from "project_id;path" lines, e.g. "7;D:\github\repos\storm"
+def read_repo_paths(path):
+    repo_paths = dict()
+    with open(path, 'r') as open_r:
+        for line in open_r:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                project_id, repo_path = line.split(';', 1)
+                repo_paths[int(project_id)] = repo_path.strip()
+    return repo_paths
 
-        repo = Repo(repo_paths[counter - 1])
 
-        if project_id not in rr_grouped_by_project.groups:
-            continue
-        project_rrs = rr_grouped_by_project.get_group(project_id)
-        project_refs = refs_grouped_by_project.get_group(project_id)
-
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        involved = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-        for index, group in involved.groupby('merge_commit_id'):
-            for _, row in group.iterrows():
-                line = []
-                merge_commit_id = row['merge_commit_id']
-                line.append(str(row['merge_parent']))
-                four_commits = get_merge_scenario(repo, project_id, merge_commits, merge_commit_id)
-                if four_commits != None:
-                    line.append(";".join(four_commits))
-                refactoring_id = row['refactoring_id']
-                # source = project_rrs[(project_rrs['refactoring_id'] == refactoring_id) & (project_rrs['type'] == 's')]
-                # target = project_rrs[(project_rrs['refactoring_id'] == refactoring_id) & (project_rrs['type'] == 'd')]
-                #  get refactoring detail by refactoring_id
-                refactoring = project_refs[project_refs['id'] == refactoring_id]
-                line.append(refactoring['refactoring_type'].iloc[0])
-                line.append(refactoring['refactoring_detail'].iloc[0])
-                line.append(row['old_path'])
-                line.append(str(row['old_start_line']))
-                line.append(row['new_path'])
-                line.append(str(row['new_start_line']))
-                if four_commits != None:
-                    print_to_csv(csv_path, line)
-        # remove duplicates
-
-
-# get four commits by merge_commit_id
-def get_merge_scenario(repo, project_id, merge_commits, merge_commit_id):
-    row_series = merge_commits[(merge_commits['project_id'] == project_id) & (merge_commits['id'] == merge_commit_id)]
+def get_repo_name(repo_path):
+    return re.split(r'[\\/]', repo_path.rstrip('\\/'))[-1]
+
+
+merge_scenario_row_columns = ['merge_parent', 'commit_hash', 'parent_1', 'parent_2', 'refactoring_type',
+                              'refactoring_detail', 'old_path', 'old_start_line', 'new_path', 'new_start_line']
+
+
+# The involved rows of a project with their merge commit and refactoring, grouped by merge commit like the CSV lists
+# them
+@per_project
+def merge_scenario_rows_of(project_id, involved, merge_commits, refactorings):
+    rows = involved.sort_values('merge_commit_id', kind='mergesort')[
+        ['merge_commit_id', 'merge_parent', 'refactoring_id', 'old_path', 'old_start_line', 'new_path',
+         'new_start_line']]
+    rows = rows.merge(merge_commits[['id', 'commit_hash', 'parent_1', 'parent_2']], how='left',
+                      left_on='merge_commit_id', right_on='id')
+    rows = rows.merge(refactorings[['id', 'refactoring_type', 'refactoring_detail']].rename(
+        columns={'id': 'refactoring_id'}), how='left', on='refactoring_id')
+    return rows[merge_scenario_row_columns]
+
+
+@per_project
+def resolve_scenario_merge_bases(project_id, repo_path, rows):
+    return resolve_merge_bases(Repo(repo_path), zip(rows['parent_1'], rows['parent_2']))
+
+
+@per_project
+def write_merge_scenarios(project_id, csv_path, rows, merge_bases):
+    # duplicate lines are skipped by the writer
+    with CsvWriter(csv_path, merge_scenario_header) as writer:
+        for row in rows.itertuples(index=False):
+            merge_base = merge_bases[(str(row.parent_1), str(row.parent_2))]
+            if merge_base is not None:
+                writer.write([str(row.merge_parent), row.commit_hash, row.parent_1, row.parent_2, merge_base,
+                              row.refactoring_type, row.refactoring_detail, row.old_path, str(row.old_start_line),
+                              row.new_path, str(row.new_start_line)])
+    return writer.written_rows
+
+
+# analyze data generated in MySql database by https://github.com/Symbolk/RefactoringsInMergeCommits
+# Writes merge_scenarios_involved_refactorings_<repo name>.csv for every project of repo_paths (project id -> clone).
+# The data frame work runs in the worker processes of parallel.py, and git merge-base runs in its own pool of threads,
+# on git_repositories repositories at a time with at most merge_bases.git_workers processes in each.
+def get_merge_scenarios_involved_refactorings(repo_paths=None):
+    repo_paths = {int(project_id): path for project_id, path in (repo_paths or default_repo_paths).items()}
+    project_filter = [('project_id', 'in', list(repo_paths))]
+    refactorings = read_sql_table('refactoring', ['id', 'project_id', 'refactoring_type', 'refactoring_detail'],
+                                  get_type_filter() + project_filter)
+    merge_commits = read_sql_table('merge_commit', merge_scenario_columns, project_filter)
+    refs_by_project = dict(list(refactorings.groupby('project_id')))
+    mcs_by_project = dict(list(merge_commits.groupby('project_id')))
+
+    started = time.time()
+    finished = 0
+    with get_executor() as data_executor, ThreadPoolExecutor(max_workers=max(1, git_repositories)) as git_executor:
+        row_futures = dict()
+        for project_id, involved in get_involved_crh_rr_by_project():
+            if project_id in repo_paths:
+                row_futures[instrumentation.submit(
+                    data_executor, merge_scenario_rows_of, project_id, involved,
+                    mcs_by_project.get(project_id, merge_commits.iloc[:0]),
+                    refs_by_project.get(project_id, refactorings.iloc[:0]))] = project_id
+        for project_id in set(repo_paths) - set(row_futures.values()):
+            print('Project {}: no conflicting region histories'.format(project_id))
+
+        git_futures = dict()
+        for future in as_completed(row_futures):
+            project_id = row_futures[future]
+            rows = instrumentation.get_result(future)
+            print('Project {}: {} involved rows, resolving merge bases in {}'.format(
+                project_id, len(rows), repo_paths[project_id]))
+            git_futures[git_executor.submit(
+                resolve_scenario_merge_bases, project_id, repo_paths[project_id], rows)] = (project_id, rows)
+
+        for future in as_completed(git_futures):
+            project_id, rows = git_futures[future]
+            csv_path = 'merge_scenarios_involved_refactorings_' + get_repo_name(repo_paths[project_id]) + '.csv'
+            written_rows = write_merge_scenarios(project_id, csv_path, rows, future.result())
+            finished += 1
+            print('Project {} done ({}/{}, {:.1f}s): {} lines written to {}'.format(
+                project_id, finished, len(git_futures), time.time() - started, written_rows, csv_path))
+
+
+# Merge bases of the parents of the given merge commits of a project, resolved in one batch
+def resolve_project_merge_bases(repo, project_id, merge_commit_index, merge_commit_ids):
+    return resolve_merge_bases(repo, [merge_commit_index[(project_id, merge_commit_id)][1:]
+                                      for merge_commit_id in merge_commit_ids
+                                      if (project_id, merge_commit_id) in merge_commit_index])
+
+
+# get four commits by merge_commit_id, merge_commit_index comes from lookup.index_merge_commits and merge_bases from
+# resolve_project_merge_bases
+def get_merge_scenario(merge_bases, project_id, merge_commit_index, merge_commit_id):
     # merge_commit, parent1(ours), parent2(theirs)
+    commit_hash, parent1, parent2 = merge_commit_index[(project_id, merge_commit_id)]
     four_commits = []
-    four_commits.append(row_series['commit_hash'].iloc[0])
-    parent1 = row_series['parent_1'].iloc[0]
-    parent2 = row_series['parent_2'].iloc[0]
-    merge_base = get_merge_base(repo, parent1, parent2)
+    four_commits.append(commit_hash)
+    merge_base = merge_bases[(str(parent1), str(parent2))]
     if merge_base!=None:
         four_commits.append(parent1)
         four_commits.append(parent2)
@@ -440,63 +691,29 @@ def get_merge_scenario(repo, project_id, merge_commits, merge_commit_id):
         return four_commits
 
 
-def get_merge_base(repo, parent1, parent2):
-    merge_base_commits = repo.merge_base(parent1, parent2)
-    if len(merge_base_commits) > 0:
-        return str(merge_base_commits[0])
-    return None
-
-def print_to_csv(path, line):
-    if not os.path.isfile(path):
-        with open(path, "w") as open_w:
-            # header
-            # open_w.write("ref_type;ref_detail;commit_hash;merge_parent;merge_commit;parent_1;parent_2;merge_base")
-            open_w.write(
-                "merge_parent;merge_commit;parent1;parent2;merge_base;ref_type;ref_detail;old_path;old_start_line;new_path;new_start_line")
-    with open(path, 'a') as open_a:
-        open_a.write('\n' + ';'.join(line))
-
-
-
 def get_merge_scenario_involved_refactorings():
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
-    merge_commits = get_merge_commits()
+    merge_commit_index = index_merge_commits(get_merge_commits(merge_scenario_columns))
 
-    cr_count_per_merge = conflicting_region_histories.groupby(
-        'merge_commit_id').conflicting_region_id.nunique().to_frame().rename(
-        columns={'conflicting_region_id': 'cr_count'})
-
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
     counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
+    for project_id, involved in get_involved_crh_rr_by_project():
         counter += 1
         print('Processing project {}'.format(project_id))
         path = 'merge_scenario_' + str(counter) + '.csv'
-        if project_id not in rr_grouped_by_project.groups:
-            continue
-        project_rrs = rr_grouped_by_project.get_group(project_id)
-        crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash', how='inner')
-        involved = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-        for index, group in involved.groupby('merge_commit_id'):
-            for _, row in group.iterrows():
-                four_commits = get_four_commits(merge_commits, row.merge_commit_id, project_id)
-                save_to_csv(path, row, four_commits)
+        with CsvWriter(path) as writer:
+            for index, group in involved.groupby('merge_commit_id'):
+                for _, row in group.iterrows():
+                    four_commits = get_four_commits(merge_commit_index, row.merge_commit_id, project_id)
+                    save_to_csv(writer, row, four_commits)
 
 
-def get_four_commits(merge_commits, merge_commit_id, project_id):
-    four_commits = []
-    for index, row in merge_commits.iterrows():
-        if row['project_id'] == project_id and row['id'] == merge_commit_id:
-            four_commits.append(row['commit_hash'])
-            four_commits.append(row['parent_1'])
-            four_commits.append(row['parent_2'])
-            # four_commits.append(get_merge_base_commit(row['parent_1'], row['parent_2']))
-            break
+def get_four_commits(merge_commit_index, merge_commit_id, project_id):
+    # merge commit, parent 1 and parent 2, or nothing for an unknown merge commit
+    four_commits = list(merge_commit_index.get((project_id, merge_commit_id), ()))
+    # four_commits.append(get_merge_base_commit(row['parent_1'], row['parent_2']))
     return four_commits
 
 
-def save_to_csv(path, row, four_commits):
+def save_to_csv(writer, row, four_commits):
     line = []
     line.append(str(row.merge_commit_id))
     # merge scenario commits
@@ -506,50 +723,85 @@ def save_to_csv(path, row, four_commits):
     line.append(str(row.commit_hash))
     line.append(str(row.refactoring_id))
     line.append(str(row.refactoring_commit_id))
-
-    with open(path, 'a') as open_a:
-        open_a.write('\n' + ';'.join(line))
+    writer.write(line)
 
 
 def get_merge_commit_by_crh_and_devs_and_involved_refactorings():
-    conflicting_region_histories = get_conflicting_region_histories()
-    refactoring_regions = get_accepted_refactoring_regions()
-
     mc_by_crh_and_devs_and_involved_refactorings = pd.DataFrame()
-    rr_grouped_by_project = refactoring_regions.groupby('project_id')
-    counter = 0
-    for project_id, project_crh in conflicting_region_histories.groupby('project_id'):
-        counter += 1
-        print('Processing project {}'.format(counter))
-
-        involved_refs_count = pd.DataFrame(columns={'involved_refs'})
-        if project_id in rr_grouped_by_project.groups:
-            project_rrs = rr_grouped_by_project.get_group(project_id)
-            crh_rr_combined = pd.merge(project_crh.reset_index(), project_rrs.reset_index(), on='commit_hash',
-                                       how='inner')
-            crh_with_involved_refs = crh_rr_combined[crh_rr_combined.apply(record_involved, axis=1)]
-            involved_refs_count = crh_with_involved_refs.groupby('merge_commit_id').size().to_frame().rename(
-                columns={0: 'involved_refs'})
-
-        crh_count = project_crh.groupby('merge_commit_id').commit_hash.nunique().to_frame().rename(
-            columns={'commit_hash': 'crh'})
-        devs_count = project_crh.groupby('merge_commit_id').author_email.nunique().to_frame().rename(
-            columns={'author_email': 'devs'})
-
-        this_project = crh_count.join(devs_count, how='outer').join(involved_refs_count, how='outer').fillna(0).astype(
-            int)
+    for project_id, this_project in map_projects_incrementally(
+            'crh_and_devs_and_involved_refactorings_of_project', crh_and_devs_and_involved_refactorings_of,
+            'conflicting_region_history', frame_sources['merge_commit_by_crh_and_devs_and_involved_refactorings'],
+            crh_and_devs_and_involved_refactorings_tasks, get_types_key()):
         mc_by_crh_and_devs_and_involved_refactorings = mc_by_crh_and_devs_and_involved_refactorings.append(this_project)
 
     return mc_by_crh_and_devs_and_involved_refactorings
 
 
-def get_data_frame(df_name):
-    try:
-        return pd.read_pickle(df_name + '.pickle')
-    except FileNotFoundError:
-        df = getattr(sys.modules[__name__], 'get_' + df_name)()
-        df.to_pickle(df_name + '.pickle')
-        return df
+@timed
+def crh_and_devs_and_involved_refactorings_tasks(project_ids):
+    crh_columns = ['project_id', 'merge_commit_id', 'commit_hash', 'author_email']
+    involved_by_project = dict(get_involved_crh_rr_by_project())
+    if database.streaming:
+        return ((project_id, project_crh, involved_by_project.get(project_id)) for project_id, project_crh in
+                stream_by_project(stream_sql_table('conflicting_region_history', crh_columns,
+                                                   project_filter(project_ids)), None, project_ids, crh_columns))
+    conflicting_region_histories = get_conflicting_region_histories(crh_columns, filters=project_filter(project_ids))
+    return [(project_id, project_crh, involved_by_project.get(project_id))
+            for project_id, project_crh in group_by_project(conflicting_region_histories, project_ids)]
+
+
+@per_project
+def crh_and_devs_and_involved_refactorings_of(project_id, project_crh, crh_with_involved_refs):
+    print('Processing project {}'.format(project_id))
+
+    involved_refs_count = pd.DataFrame(columns={'involved_refs'})
+    if crh_with_involved_refs is not None:
+        involved_refs_count = crh_with_involved_refs.groupby('merge_commit_id').size().to_frame().rename(
+            columns={0: 'involved_refs'})
+
+    crh_count = project_crh.groupby('merge_commit_id').commit_hash.nunique().to_frame().rename(
+        columns={'commit_hash': 'crh'})
+    devs_count = project_crh.groupby('merge_commit_id').author_email.nunique().to_frame().rename(
+        columns={'author_email': 'devs'})
+
+    return crh_count.join(devs_count, how='outer').join(involved_refs_count, how='outer').fillna(0).astype(int)
+
+
+# Tables each derived data frame is computed from, directly or through the involvement relation. Frames not listed
+# depend on all the analysis tables. These are the frames jobs.py computes, so the drivers that need the clones of the
+# projects or write CSV files (get_involved_refactorings_by_refactoring_type and the merge scenario writers) are not
+# listed.
+frame_sources = {
+    'conflicting_regions_by_count_of_involved_refactoring': ['conflicting_region'] + involvement_tables,
+    'conflicting_region_size_by_involved_refactoring_size': ['conflicting_region'] + involvement_tables,
+    'conflicting_merge_commit_by_merge_author_involvement_in_conflict': ['merge_commit'] + involvement_tables,
+    'refactorings_by_refactoring_type': ['refactoring'],
+    'refactoring_type_counts': involvement_tables,
+    'refactorings_by_refactoring_type_split_by_involved': involvement_tables,
+    'conflicting_regions_by_involved_refactorings_per_merge_commit': involvement_tables,
+    'merge_commit_by_crh_and_devs_and_involved_refactorings': involvement_tables,
+}
+
+
+# Cached by producer (name and code), parameters and the state of the source tables, so that importing a new dump or
+# editing the producer recomputes the frame.
+def get_data_frame_entry(df_name, **params):
+    producer = getattr(sys.modules[__name__], 'get_' + df_name)
+    key = dict(params, code=digest(inspect.getsource(producer)))
+    return producer, key, get_tables_fingerprint(frame_sources.get(df_name, analysis_tables))
+
+
+def is_data_frame_cached(df_name, **params):
+    _, key, fingerprint = get_data_frame_entry(df_name, **params)
+    return cache.contains(df_name, key, fingerprint)
+
+
+def get_data_frame(df_name, **params):
+    producer, key, fingerprint = get_data_frame_entry(df_name, **params)
+    with stage('get_data_frame', detail=df_name) as current:
+        df = get_or_compute(df_name, lambda: producer(**params), key, fingerprint)
+        current.rows_out = len(df)
+    return df
 
 
 def to_csv():
@@ -576,64 +828,99 @@ def print_stats():
     print_git_conflict_stats()
 
 
+summary_tables = ['merge_commit', 'conflicting_java_file', 'conflicting_region', 'conflicting_region_history',
+                  'refactoring']
+general_stats = ['All Merge Scenarios', 'Conflicting Mer Ss', 'CMS w/ Java Conf', 'Conflicting Region',
+                 'Evolutionary Cmt', 'Refactoring in ECmt']
+
+
+# Row counts per project behind the stats tables, as (kind, stat, project_id, amount) rows: kind 'general' for the
+# general stats and 'conflict' for the conflicting Java files of each conflict type. Projects without rows for a stat
+# have no row for it, like in a group by project_id.
+def get_project_summary():
+    if database.backend == 'snapshot':
+        return get_project_summary_of_snapshot()
+    query = ' union all '.join([
+        "select 'general' as kind, 'All Merge Scenarios' as stat, project_id, count(*) as amount from merge_commit "
+        "group by project_id",
+        "select 'general', 'Conflicting Mer Ss', project_id, count(*) from merge_commit where is_conflicting = 1 "
+        "group by project_id",
+        "select 'general', 'CMS w/ Java Conf', project_id, count(*) from merge_commit "
+        "where id in (select merge_commit_id from conflicting_java_file) group by project_id",
+        "select 'general', 'Conflicting Region', project_id, count(*) from conflicting_region group by project_id",
+        "select 'general', 'Evolutionary Cmt', project_id, count(*) from conflicting_region_history "
+        "group by project_id",
+        "select 'general', 'Refactoring in ECmt', project_id, count(*) from refactoring "
+        "where refactoring_type in :types group by project_id",
+        "select 'conflict', type, project_id, count(*) from conflicting_java_file group by type, project_id"])
+    return read_query(query, 'project_summary', {'types': get_types()})
+
+
+def get_project_summary_of_snapshot():
+    merge_commits = read_table('merge_commit', ['id', 'project_id', 'is_conflicting'])
+    java_files = read_table('conflicting_java_file', ['type', 'merge_commit_id', 'project_id'])
+    counted = [('All Merge Scenarios', merge_commits),
+               ('Conflicting Mer Ss', merge_commits[merge_commits['is_conflicting'] == 1]),
+               ('CMS w/ Java Conf', merge_commits[merge_commits['id'].isin(java_files['merge_commit_id'])]),
+               ('Conflicting Region', read_table('conflicting_region', ['project_id'])),
+               ('Evolutionary Cmt', read_table('conflicting_region_history', ['project_id'])),
+               ('Refactoring in ECmt', get_accepted_refactorings(['project_id']))]
+    summary = [df.groupby('project_id').size().rename('amount').reset_index().assign(kind='general', stat=title)
+               for title, df in counted]
+    summary.append(java_files.groupby(['type', 'project_id']).size().rename('amount').reset_index()
+                   .rename(columns={'type': 'stat'}).assign(kind='conflict'))
+    return pd.concat(summary, ignore_index=True)[['kind', 'stat', 'project_id', 'amount']]
+
+
+# Total, number of repos, mean and SD over the projects of every stat, from the cached project summary
+def get_summary_stats():
+    summary = get_or_compute('project_summary', get_project_summary,
+                             fingerprint=get_tables_fingerprint(summary_tables))
+    return summary.groupby(['kind', 'stat'])['amount'].agg(['sum', 'size', 'mean', 'std'])
+
+
+def get_summary_stats_of(summary_stats, kind):
+    if kind not in summary_stats.index.get_level_values('kind'):
+        return summary_stats.iloc[:0].reset_index(level='kind', drop=True)
+    return summary_stats.xs(kind, level='kind')
+
+
 def print_general_stats():
-    con = get_db_connection()
-    stat_list = list()
-    stat_list.append(
-        ('All Merge Scenarios', pd.read_sql_query('select count(*) from merge_commit group by project_id', con)))
-    stat_list.append(('Conflicting Mer Ss', pd.read_sql_query(
-        'select count(*) from merge_commit where is_conflicting = 1 group by project_id', con)))
-    stat_list.append(('CMS w/ Java Conf', pd.read_sql_query(
-        'select count(*) from merge_commit where id in (select merge_commit_id from conflicting_java_file) group by project_id',
-        con)))
-    stat_list.append(
-        ('Conflicting Region', pd.read_sql_query('select count(*) from conflicting_region group by project_id', con)))
-    stat_list.append(('Evolutionary Cmt',
-                      pd.read_sql_query('select count(*) from conflicting_region_history group by project_id', con)))
-    stat_list.append(
-        ('Refactoring in ECmt', pd.read_sql_query('select count(*) from refactoring where ({}) group by project_id'.
-                                                  format(get_refactoring_types_sql_condition()), con)))
+    stats = get_summary_stats_of(get_summary_stats(), 'general').reindex(general_stats)
+    stats[['sum', 'size']] = stats[['sum', 'size']].fillna(0).astype(int)
 
     layout_str = '{}\t|{}\t|\t{}\t|\t{} | {}'
     print(layout_str.format('Stat', 'Total', 'Corresponding Repos', 'Mean', 'SD'))
-    for (title, stat) in stat_list:
-        print(layout_str.format(title, stat.sum().iloc[0], stat.size, stat.mean().iloc[0], stat.std().iloc[0]))
+    for title, total, repos, mean, sd in stats[['sum', 'size', 'mean', 'std']].itertuples():
+        print(layout_str.format(title, total, repos, mean, sd))
 
 
 def print_git_conflict_stats():
-    con = get_db_connection()
-    conflict_types = pd.read_sql_query(
-        'select type as conflict_type, count(*) from conflicting_java_file group by type order by count(*) desc', con)
-
-    stat_list = list()
-    for conflict_type in conflict_types['conflict_type']:
-        stat_list.append(pd.read_sql_query(
-            'select count(*) from conflicting_java_file where type = "{}" group by project_id'.format(conflict_type),
-            con))
+    stats = get_summary_stats_of(get_summary_stats(), 'conflict').sort_values('sum', ascending=False, kind='mergesort')
 
     layout_str = '{}\t|\t{}\t|\t{}\t|\t{} | {}'
     print(layout_str.format('Type', 'Total', 'Corresponding Repos', 'Mean', 'SD'))
-    for i in range(len(conflict_types)):
-        conflict_type = conflict_types['conflict_type'][i]
-        stat = stat_list[i]
-        print(layout_str.format(conflict_type, stat.sum().iloc[0], stat.size, stat.mean().iloc[0], stat.std().iloc[0]))
+    for conflict_type, total, repos, mean, sd in stats[['sum', 'size', 'mean', 'std']].itertuples():
+        print(layout_str.format(conflict_type, total, repos, mean, sd))
 
 
 def cohen_d(x, y):
-    nx = len(x)
-    ny = len(y)
-    dof = nx + ny - 2
-    return (mean(x) - mean(y)) / sqrt(((nx - 1) * std(x, ddof=1) ** 2 + (ny - 1) * std(y, ddof=1) ** 2) / dof)
+    return float(effect_size.cohen_d(x, y)[0])
 
 
+# Cohen's d, Cliff's delta and Vargha-Delaney A of the share of every refactoring type in the projects with involved
+# refactorings against all projects, with bootstrap confidence intervals
 def cohen_delta_refactoring_types_involved_vs_overall():
-    all_refs = get_data_frame('refactorings_by_refactoring_type').fillna(0).T
-    involved_refs = get_data_frame('involved_refactorings_by_refactoring_type').fillna(0).T
+    counts = get_data_frame('refactoring_type_counts')
+    all_refs = refactoring_type_matrix(counts, share=True).fillna(0)
+    involved_refs = refactoring_type_matrix(counts, 'involved', share=True).reindex(columns=all_refs.columns).fillna(0)
 
-    cohen = dict()
-    for refactoring_type in all_refs.columns:
-        cohen[refactoring_type] = cohen_d(involved_refs[refactoring_type], all_refs[refactoring_type])
-        print("{}:\t{}".format(refactoring_type, cohen[refactoring_type]))
+    effect_sizes = effect_size.effect_sizes(involved_refs, all_refs)
+    for refactoring_type, row in effect_sizes.iterrows():
+        print("{}:\t{} [{}, {}]\tCliff's delta {} [{}, {}]".format(
+            refactoring_type, row['cohen_d'], row['cohen_d_low'], row['cohen_d_high'], row['cliffs_delta'],
+            row['cliffs_delta_low'], row['cliffs_delta_high']))
+    return effect_sizes
 
 
 if __name__ == '__main__':
@@ -642,4 +929,5 @@ if __name__ == '__main__':
     # get_conflicting_regions_by_involved_refactorings_per_merge_commit()
     # get_merge_scenario_involved_refactorings()
     # get_involved_refactorings_by_refactoring_type()
-    get_merge_scenarios_involved_refactorings()
+    # python data_resolver.py [file of "project_id;clone path" lines]
+    get_merge_scenarios_involved_refactorings(read_repo_paths(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,466 @@
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, event, exc, text
+
+from encoding import align_frames, compact_frame
+from instrumentation import stage
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+properties_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'database.properties')
+
+default_config = {
+    'username': 'root',
+    'password': 'passwd',
+    'server': '127.0.0.1',
+    'database_name': 'refactoring_analysis',
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+}
+pool_options = ['pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle']
+
+db_config = None
+engine = None
+engine_lock = threading.Lock()
+pool_counters = {'connects': 0, 'checkouts': 0, 'invalidated_after_fork': 0}
+table_states = dict()
+project_states = dict()
+
+# 'mysql' reads the live database, 'snapshot' reads the Parquet files exported by snapshot.py
+backend = os.environ.get('ANALYSIS_BACKEND', 'mysql')
+# SQLAlchemy URL of a database to read instead of the one of database.properties, e.g. sqlite:///synthetic.db
+database_url = os.environ.get('ANALYSIS_DATABASE_URL')
+snapshot_dir = os.environ.get('ANALYSIS_SNAPSHOT_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot'))
+
+default_chunksize = 100000
+# With ANALYSIS_STREAMING=1 the per-project analyses read the big tables through server-side cursors, ordered like
+# this, and work on one project at a time, so that their memory grows with the largest project and not with the data
+streaming = os.environ.get('ANALYSIS_STREAMING', '0') == '1'
+streaming_order = ('project_id', 'commit_hash')
+
+# Declared dtypes of the analysis tables. Columns holding NULLs keep the representation pandas gives them.
+table_schemas = {
+    'merge_commit': {
+        'id': 'int64', 'commit_hash': 'object', 'parent_1': 'object', 'parent_2': 'object', 'is_conflicting': 'int8',
+        'author_name': 'object', 'author_email': 'object', 'timestamp': 'int64', 'project_id': 'int64',
+    },
+    'conflicting_region': {
+        'id': 'int64', 'parent_1_path': 'object', 'parent_1_start_line': 'int64', 'parent_1_length': 'int64',
+        'parent_2_path': 'object', 'parent_2_start_line': 'int64', 'parent_2_length': 'int64',
+        'conflicting_java_file_id': 'int64', 'merge_commit_id': 'int64', 'project_id': 'int64',
+    },
+    'conflicting_region_history': {
+        'id': 'int64', 'commit_hash': 'object', 'merge_parent': 'int8', 'author_name': 'object',
+        'author_email': 'object', 'timestamp': 'int64', 'old_path': 'object', 'old_start_line': 'int64',
+        'old_length': 'int64', 'new_path': 'object', 'new_start_line': 'int64', 'new_length': 'int64',
+        'conflicting_region_id': 'int64', 'merge_commit_id': 'int64', 'project_id': 'int64',
+    },
+    'refactoring': {
+        'id': 'int64', 'refactoring_type': 'object', 'refactoring_detail': 'object', 'commit_hash': 'object',
+        'refactoring_commit_id': 'int64', 'project_id': 'int64',
+    },
+    'refactoring_region': {
+        'id': 'int64', 'type': 'object', 'path': 'object', 'start_line': 'int64', 'length': 'int64',
+        'commit_hash': 'object', 'refactoring_id': 'int64', 'refactoring_commit_id': 'int64', 'project_id': 'int64',
+    },
+}
+
+# Compact representation of the tables, for loaders called with compact=True: commit hashes and paths are coded in
+# dictionaries shared by all tables (see encoding.py), types become categoricals and line numbers int32.
+compact_schemas = {
+    'merge_commit': {'commit_hash': 'commit', 'parent_1': 'commit', 'parent_2': 'commit'},
+    'conflicting_region': {
+        'parent_1_path': 'path', 'parent_1_start_line': 'int32', 'parent_1_length': 'int32',
+        'parent_2_path': 'path', 'parent_2_start_line': 'int32', 'parent_2_length': 'int32',
+    },
+    'conflicting_region_history': {
+        'commit_hash': 'commit', 'old_path': 'path', 'old_start_line': 'int32', 'old_length': 'int32',
+        'new_path': 'path', 'new_start_line': 'int32', 'new_length': 'int32',
+    },
+    'refactoring': {'commit_hash': 'commit', 'refactoring_type': 'refactoring_type'},
+    'refactoring_region': {
+        'commit_hash': 'commit', 'type': 'region_type', 'path': 'path', 'start_line': 'int32', 'length': 'int32',
+    },
+}
+# conflicting_region_history x refactoring_region pairs, see involvement.join_involved
+compact_schemas['involvement'] = dict(compact_schemas['conflicting_region_history'],
+                                      **{column: representation for column, representation in
+                                         compact_schemas['refactoring_region'].items() if column != 'commit_hash'})
+
+
+# Reads database.properties. Besides the JDBC settings shared with the miner, development.pool_size,
+# development.max_overflow, development.pool_timeout and development.pool_recycle tune the connection pool.
+def read_db_config(path=properties_path):
+    config = dict(default_config)
+    with open(path, 'r') as db_file:
+        for line in db_file:
+            line = line.strip()
+            url_search = re.search('^development.url=jdbc:mysql://(.*)/(.*)$', line, re.IGNORECASE)
+            property_search = re.search('^development.(\\w+)=(.*)$', line, re.IGNORECASE)
+
+            if url_search:
+                config['server'] = url_search.group(1)
+                config['database_name'] = url_search.group(2)
+            elif property_search and property_search.group(1).lower() in config:
+                key = property_search.group(1).lower()
+                config[key] = int(property_search.group(2)) if key in pool_options else property_search.group(2)
+    return config
+
+
+def get_db_config():
+    global db_config
+    if db_config is None:
+        with engine_lock:
+            if db_config is None:
+                db_config = read_db_config()
+    return db_config
+
+
+# Overrides settings of the engine, e.g. configure_engine(pool_size=16) before starting worker threads. Takes effect
+# the next time the engine is built, so it disposes the current one.
+def configure_engine(**settings):
+    global db_config
+    config = dict(get_db_config())
+    config.update(settings)
+    with engine_lock:
+        db_config = config
+    dispose_engine()
+
+
+# Connections must not cross a fork: a child process that checks out a connection inherited from its parent gets a
+# fresh one instead, without closing the socket the parent is still using.
+def add_pool_listeners(new_engine):
+    @event.listens_for(new_engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        pool_counters['connects'] += 1
+
+    @event.listens_for(new_engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_counters['checkouts'] += 1
+        if connection_record.info['pid'] != os.getpid():
+            pool_counters['invalidated_after_fork'] += 1
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection record belongs to pid {}, attempting to check out in pid {}'
+                                         .format(connection_record.info['pid'], os.getpid()))
+
+
+# The process-wide engine, built on first use and shared by every loader
+def get_engine():
+    global engine
+    if engine is None:
+        config = get_db_config()
+        with engine_lock:
+            if engine is None:
+                if database_url is not None:
+                    # SQLite keeps its own pool, which takes none of the pool options
+                    new_engine = create_engine(database_url, **({} if database_url.startswith('sqlite') else
+                                                                {option: config[option] for option in pool_options}))
+                else:
+                    new_engine = create_engine('mysql+pymysql://{}:{}@{}/{}'.format(
+                        config['username'], config['password'], config['server'], config['database_name']),
+                        **{option: config[option] for option in pool_options})
+                add_pool_listeners(new_engine)
+                engine = new_engine
+    return engine
+
+
+# Reads another database from now on, e.g. set_database_url('sqlite:///synthetic.db'), None for database.properties
+def set_database_url(url):
+    global database_url
+    dispose_engine()
+    database_url = url
+    table_states.clear()
+    project_states.clear()
+
+
+def dispose_engine():
+    global engine
+    with engine_lock:
+        if engine is not None:
+            engine.dispose()
+        engine = None
+
+
+def get_pool_stats():
+    stats = dict(pool_counters)
+    stats['pid'] = os.getpid()
+    if engine is not None:
+        pool = engine.pool
+        stats['status'] = pool.status()
+        if hasattr(pool, 'checkedout'):
+            stats.update({'size': pool.size(), 'checked_in': pool.checkedin(), 'checked_out': pool.checkedout(),
+                          'overflow': pool.overflow()})
+    return stats
+
+
+def apply_schema(df, table, compact=False):
+    schema = table_schemas.get(table, dict())
+    for column in df.columns:
+        dtype = schema.get(column)
+        if dtype is not None and df[column].dtype != dtype and not df[column].isnull().any():
+            df[column] = df[column].astype(dtype)
+    if compact:
+        compact_frame(df, compact_schemas.get(table, dict()))
+    return df
+
+
+# Columns to select, qualified with the alias of their table when given
+def select_list(columns=None, alias=None):
+    qualifier = alias + '.' if alias else ''
+    return qualifier + '*' if columns is None else ', '.join(qualifier + column for column in columns)
+
+
+# Turns [(column, '=', value), (column, 'in', values), ...] into a where clause with bound parameters, on the columns of
+# the table aliased as alias when given
+def where_clause(filters, prefix='param', alias=None):
+    conditions = list()
+    params = dict()
+    for column, operator, value in filters or []:
+        name = '{}_{}'.format(prefix, len(params))
+        if alias:
+            column = '{}.{}'.format(alias, column)
+        if operator == '=':
+            conditions.append('{} = :{}'.format(column, name))
+        elif operator == 'in':
+            conditions.append('{} in :{}'.format(column, name))
+            value = list(value)
+        else:
+            raise ValueError('Unsupported filter operator: {}'.format(operator))
+        params[name] = value
+    return ' and '.join(conditions), params
+
+
+def to_statement(query, params):
+    statement = text(query)
+    expanding = [bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, list)]
+    if expanding:
+        statement = statement.bindparams(*expanding)
+    return statement
+
+
+# Yields a query result chunk by chunk, each cast to the declared dtypes (or the compact representation) of the table
+# it comes from. An empty result still yields one (empty) frame, so that callers get the columns.
+def iter_query(query, table, params=None, chunksize=default_chunksize, compact=False):
+    params = params or dict()
+    empty = True
+    for chunk in pd.read_sql(to_statement(query, params), get_engine(), params=params, chunksize=chunksize):
+        empty = False
+        yield apply_schema(chunk, table, compact)
+    if empty:
+        yield apply_schema(pd.read_sql(to_statement(query, params), get_engine(), params=params), table, compact)
+
+
+def read_query(query, table, params=None, chunksize=default_chunksize, compact=False):
+    with stage('read_query', detail=table) as current:
+        chunks = list(iter_query(query, table, params, chunksize, compact))
+        if compact:
+            # chunks read earlier are coded over smaller dictionaries
+            align_frames(chunks, compact_schemas.get(table, dict()))
+        df = pd.concat(chunks, ignore_index=True)
+        current.rows_out = len(df)
+    return df
+
+
+def set_streaming(enabled):
+    global streaming
+    streaming = bool(enabled)
+
+
+def set_backend(name, directory=None):
+    global backend, snapshot_dir
+    if name not in ['mysql', 'snapshot']:
+        raise ValueError('Unknown backend: {}'.format(name))
+    backend = name
+    if directory is not None:
+        snapshot_dir = directory
+
+
+def snapshot_path(table):
+    return os.path.join(snapshot_dir, table + '.parquet')
+
+
+def filter_frame(df, filters):
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for column, operator, value in filters:
+        if operator == '=':
+            mask &= (df[column] == value).to_numpy()
+        elif operator == 'in':
+            mask &= df[column].isin(list(value)).to_numpy()
+        else:
+            raise ValueError('Unsupported filter operator: {}'.format(operator))
+    return df[mask].reset_index(drop=True)
+
+
+# Reads a table of the snapshot through a memory map, loading only the requested and filtered columns
+def read_snapshot_table(table, columns=None, filters=None, compact=False):
+    if pq is None:
+        raise ImportError('Reading the snapshot backend requires pyarrow')
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) + [column for column, _, _ in filters or [] if column not in columns]
+    with stage('read_snapshot', detail=table) as current:
+        df = pq.read_table(snapshot_path(table), columns=read_columns, memory_map=True).to_pandas()
+        current.rows_in = len(df)
+        df = filter_frame(df, filters)
+        if columns is not None:
+            df = df[list(columns)]
+        df = apply_schema(df, table, compact)
+        current.rows_out = len(df)
+    return df
+
+
+def table_query(table, columns=None, filters=None):
+    query = 'select {} from {}'.format(select_list(columns), table)
+    condition, params = where_clause(filters)
+    if condition:
+        query += ' where ' + condition
+    return query, params
+
+
+def read_table(table, columns=None, filters=None, chunksize=default_chunksize, compact=False):
+    if backend == 'snapshot':
+        return read_snapshot_table(table, columns, filters, compact)
+    query, params = table_query(table, columns, filters)
+    return read_query(query, table, params, chunksize, compact)
+
+
+# Rows of table whose key is among the other_key values of the rows of other_table matching other_filters
+def read_semi_join(table, columns, key, other_table, other_key, other_filters, filters=None,
+                   chunksize=default_chunksize, compact=False):
+    if backend == 'snapshot':
+        keys = read_snapshot_table(other_table, [other_key], other_filters)[other_key].unique()
+        return read_snapshot_table(table, columns, [(key, 'in', keys)] + list(filters or []), compact)
+    other_condition, params = where_clause(other_filters, 'other_param')
+    query = 'select {} from {} where {} in (select {} from {}{})'.format(
+        select_list(columns), table, key, other_key, other_table, ' where ' + other_condition if other_condition else '')
+    condition, table_params = where_clause(filters)
+    if condition:
+        query += ' and ' + condition
+    params.update(table_params)
+    return read_query(query, table, params, chunksize, compact)
+
+
+# The rows of read_semi_join, selected with a join instead of a subquery, which MySQL plans better for large tables.
+# other_key has to be unique in other_table, like its primary key, for every row to come once.
+def read_key_join(table, columns, key, other_table, other_key, other_filters, filters=None,
+                  chunksize=default_chunksize, compact=False):
+    if backend == 'snapshot':
+        return read_semi_join(table, columns, key, other_table, other_key, other_filters, filters, chunksize, compact)
+    query, params = key_join_query(table, columns, key, other_table, other_key, other_filters, filters)
+    return read_query(query, table, params, chunksize, compact)
+
+
+def key_join_query(table, columns, key, other_table, other_key, other_filters, filters=None):
+    other_condition, params = where_clause(other_filters, 'other_param', 'o')
+    condition, table_params = where_clause(filters, alias='t')
+    params.update(table_params)
+    query = 'select {} from {} t join {} o on o.{} = t.{}'.format(select_list(columns, 't'), table, other_table,
+                                                                   other_key, key)
+    conditions = [condition for condition in [other_condition, condition] if condition]
+    if conditions:
+        query += ' where ' + ' and '.join(conditions)
+    return query, params
+
+
+# Chunks of a query result read through a server-side cursor: the database hands the rows over as they are consumed
+# instead of the driver buffering the whole result first
+def iter_query_streamed(query, table, params=None, chunksize=default_chunksize, compact=False):
+    params = params or dict()
+    with get_engine().connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(to_statement(query, params), connection, params=params, chunksize=chunksize):
+            yield apply_schema(chunk, table, compact)
+
+
+def iter_sorted(df, order_by, chunksize):
+    df = df.sort_values(list(order_by), kind='mergesort').reset_index(drop=True)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+# Chunks of the rows of a table in the order of the order_by columns, which have to be among the columns, streamed
+# from the database. The snapshot backend sorts the table in memory.
+def stream_table(table, columns=None, filters=None, order_by=streaming_order, chunksize=default_chunksize,
+                 compact=False):
+    if backend == 'snapshot':
+        return iter_sorted(read_snapshot_table(table, columns, filters, compact), order_by, chunksize)
+    query, params = table_query(table, columns, filters)
+    return iter_query_streamed(query + ' order by ' + ', '.join(order_by), table, params, chunksize, compact)
+
+
+# read_key_join, streamed like stream_table
+def stream_key_join(table, columns, key, other_table, other_key, other_filters, filters=None,
+                    order_by=streaming_order, chunksize=default_chunksize, compact=False):
+    if backend == 'snapshot':
+        return iter_sorted(read_semi_join(table, columns, key, other_table, other_key, other_filters, filters,
+                                          chunksize, compact), order_by, chunksize)
+    query, params = key_join_query(table, columns, key, other_table, other_key, other_filters, filters)
+    return iter_query_streamed(query + ' order by ' + ', '.join('t.' + column for column in order_by), table, params,
+                               chunksize, compact)
+
+
+# (value of key, rows) for every run of rows with the same value of key in ordered chunks, e.g. one project at a time.
+# Only the rows of the run that goes on into the next chunk are held back. schema is the compact schema of the table,
+# to bring the rows of a run that spans chunks onto the same dictionaries.
+def iter_groups(chunks, key, schema=None):
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            if schema:
+                align_frames([pending, chunk], schema)
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if chunk.empty:
+            pending = chunk
+            continue
+        values = chunk[key].to_numpy()
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+        last_start = starts[-1] if len(starts) else 0
+        for value, rows in chunk.iloc[:last_start].groupby(key, sort=False, observed=True):
+            yield value, rows.reset_index(drop=True)
+        pending = chunk.iloc[last_start:].copy()
+    if pending is not None and not pending.empty:
+        yield pending[key].iloc[0], pending.reset_index(drop=True)
+
+
+# Row count and max id of a table, plus its checksum when asked for (CHECKSUM TABLE reads the whole table). Read once
+# per process: a run works against one state of the database.
+def get_table_state(table, checksum=False):
+    if (backend, table, checksum) not in table_states:
+        if backend == 'snapshot':
+            ids = read_snapshot_table(table, ['id'])['id']
+            state = '{}:{}:{}'.format(table, len(ids), ids.max())
+        else:
+            counts = pd.read_sql('select count(*) as row_count, max(id) as max_id from ' + table, get_engine())
+            state = '{}:{}:{}'.format(table, counts['row_count'].iloc[0], counts['max_id'].iloc[0])
+            if checksum:
+                state += ':' + str(pd.read_sql('checksum table ' + table, get_engine())['Checksum'].iloc[0])
+        table_states[(backend, table, checksum)] = state
+    return table_states[(backend, table, checksum)]
+
+
+# Row count and max id of every project in a table, read once per process like get_table_state
+def get_project_states(table):
+    if (backend, table) not in project_states:
+        if backend == 'snapshot':
+            counts = read_snapshot_table(table, ['project_id', 'id']).groupby('project_id')['id'].agg(
+                ['count', 'max']).rename(columns={'count': 'row_count', 'max': 'max_id'})
+        else:
+            counts = pd.read_sql('select project_id, count(*) as row_count, max(id) as max_id from {} '
+                                 'group by project_id'.format(table), get_engine(), index_col='project_id')
+        project_states[(backend, table)] = {
+            int(project_id): '{}:{}:{}'.format(table, row_count, max_id)
+            for project_id, row_count, max_id in counts[['row_count', 'max_id']].itertuples()}
+    return project_states[(backend, table)]
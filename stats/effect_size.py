@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from parallel import map_projects
+
+# Effect sizes of two samples, for many variables (the columns) at once, with percentile bootstrap confidence intervals.
+# A batch of resamples is drawn as a matrix of how often every observation is picked, so that the statistics of the
+# whole batch come out of a few matrix products; the batches run in the ANALYSIS_WORKERS processes.
+resamples = 10000
+batch_size = 500
+confidence = .95
+
+
+def as_matrix(values):
+    values = np.asarray(values, dtype=float)
+    return values.reshape(-1, 1) if values.ndim == 1 else values
+
+
+def pooled_difference(nx, mean_x, var_x, ny, mean_y, var_y):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean_x - mean_y) / np.sqrt(((nx - 1) * var_x + (ny - 1) * var_y) / (nx + ny - 2))
+
+
+# Cohen's d of every column of x against the same column of y, with the pooled standard deviation
+def cohen_d(x, y):
+    x, y = as_matrix(x), as_matrix(y)
+    return pooled_difference(len(x), x.mean(axis=0), x.var(axis=0, ddof=1),
+                             len(y), y.mean(axis=0), y.var(axis=0, ddof=1))
+
+
+# sign(x_i - y_j) for every pair of observations and every column: an nx x ny x columns matrix
+def dominance(x, y):
+    return np.sign(x[:, np.newaxis, :] - y[np.newaxis, :, :]).astype(np.int8)
+
+
+# Cliff's delta of every column: P(x > y) - P(x < y)
+def cliffs_delta(x, y):
+    x, y = as_matrix(x), as_matrix(y)
+    return dominance(x, y).mean(axis=(0, 1))
+
+
+# Cohen's d and Cliff's delta of size resamples of x and of y, drawn with replacement, each resample given by how
+# many times it picks every observation
+def bootstrap_batch(x, y, size, seed):
+    random = np.random.default_rng(seed)
+    nx, ny = len(x), len(y)
+    picks_x = random.multinomial(nx, np.full(nx, 1. / nx), size=size).astype(float)
+    picks_y = random.multinomial(ny, np.full(ny, 1. / ny), size=size).astype(float)
+
+    mean_x, mean_y = picks_x @ x / nx, picks_y @ y / ny
+    var_x = (picks_x @ x ** 2 / nx - mean_x ** 2) * nx / (nx - 1)
+    var_y = (picks_y @ y ** 2 / ny - mean_y ** 2) * ny / (ny - 1)
+    d = pooled_difference(nx, mean_x, np.maximum(var_x, 0), ny, mean_y, np.maximum(var_y, 0))
+    # sum over the pairs of both resamples of the dominance of the pair
+    delta = np.einsum('bjk,bj->bk', np.tensordot(picks_x, dominance(x, y).astype(float), axes=(1, 0)),
+                      picks_y) / (nx * ny)
+    return d, delta
+
+
+def bootstrap(x, y, resamples=resamples, seed=0):
+    batches = -(-resamples // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(batches)
+    results = map_projects(bootstrap_batch, [(x, y, min(batch_size, resamples - i * batch_size), seeds[i])
+                                             for i in range(batches)])
+    return np.vstack([d for d, _ in results]), np.vstack([delta for _, delta in results])
+
+
+def interval(samples, confidence):
+    with np.errstate(invalid='ignore'):
+        return np.nanpercentile(samples, [50 * (1 - confidence), 50 * (1 + confidence)], axis=0)
+
+
+# Cohen's d, Cliff's delta and the Vargha-Delaney A (the probability that x is larger than y, ties counting half) of
+# every column of the data frames x and y, with their bootstrap confidence intervals. The same seed gives the same
+# intervals whatever the number of workers.
+def effect_sizes(x, y, resamples=resamples, confidence=confidence, seed=0):
+    columns = x.columns
+    x_values = as_matrix(x[columns].values)
+    y_values = as_matrix(y[columns].values)
+    d = cohen_d(x_values, y_values)
+    delta = cliffs_delta(x_values, y_values)
+    d_samples, delta_samples = bootstrap(x_values, y_values, resamples, seed)
+    (d_low, d_high), (delta_low, delta_high) = interval(d_samples, confidence), interval(delta_samples, confidence)
+    return pd.DataFrame({
+        'n_x': len(x_values), 'n_y': len(y_values),
+        'cohen_d': d, 'cohen_d_low': d_low, 'cohen_d_high': d_high,
+        'cliffs_delta': delta, 'cliffs_delta_low': delta_low, 'cliffs_delta_high': delta_high,
+        'vargha_delaney_a': (delta + 1) / 2, 'vargha_delaney_a_low': (delta_low + 1) / 2,
+        'vargha_delaney_a_high': (delta_high + 1) / 2,
+    }, index=columns)
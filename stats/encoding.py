@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Dictionaries shared by all the frames of a process, by domain ('commit', 'path', ...): a value gets the same code in
+# every table it is loaded from, so that comparing or joining such columns compares integers. Dictionaries only grow,
+# so codes handed out once stay valid.
+domains = dict()
+domains_lock = threading.Lock()
+
+
+def get_domain(domain):
+    return domains.get(domain, pd.Index([], dtype=object))
+
+
+# Categorical of the values over the dictionary of the domain, adding the values it does not know yet
+def encode(values, domain):
+    with domains_lock:
+        categories = get_domain(domain)
+        codes = categories.get_indexer(values)
+        unknown = (codes < 0) & values.notnull().to_numpy()
+        if unknown.any():
+            categories = categories.append(pd.Index(pd.unique(values[unknown]), dtype=object))
+            codes[unknown] = categories.get_indexer(values[unknown])
+        domains[domain] = categories
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+
+# Recodes a column encoded earlier over the current dictionary of its domain, which only changes the categories
+def align(values, domain):
+    categories = get_domain(domain)
+    current = values.cat.categories
+    if current.equals(categories):
+        return values
+    if len(current) <= len(categories) and categories[:len(current)].equals(current):
+        return pd.Series(pd.Categorical.from_codes(values.cat.codes.to_numpy(), categories), index=values.index,
+                         name=values.name)
+    return encode(values.astype(object), domain)
+
+
+# Applies a compact schema ({column: domain or 'int32'}) to a frame. Line numbers only become int32 without NULLs.
+def compact_frame(df, schema):
+    for column, representation in schema.items():
+        if column not in df.columns:
+            continue
+        if representation == 'int32':
+            values = df[column]
+            if values.dtype.kind == 'i' and (len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and
+                                                                  values.max() <= np.iinfo(np.int32).max)):
+                df[column] = values.astype(np.int32)
+        elif pd.api.types.is_categorical_dtype(df[column]):
+            df[column] = align(df[column], representation)
+        else:
+            df[column] = encode(df[column], representation)
+    return df
+
+
+# Brings frames compacted at different times onto the same dictionaries, e.g. before concatenating them
+def align_frames(frames, schema):
+    for df in frames:
+        for column, representation in schema.items():
+            if representation != 'int32' and column in df.columns and pd.api.types.is_categorical_dtype(df[column]):
+                df[column] = align(df[column], representation)
+    return frames
+
+
+# Drops the categories a frame does not use, e.g. before sending it to another process or storing it
+def shrink_categories(df):
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_categorical_dtype(df[column]):
+            df[column] = df[column].cat.remove_unused_categories()
+    return df
@@ -0,0 +1,70 @@
+import hashlib
+import inspect
+import os
+
+from cache import digest, lookup, store
+from database import get_project_states
+from parallel import map_projects
+
+# Store the partial result of every project and only recompute the projects whose rows changed since
+incremental = os.environ.get('ANALYSIS_INCREMENTAL', '0') == '1'
+
+
+def set_incremental(enabled):
+    global incremental
+    incremental = bool(enabled)
+
+
+# Identifies the rows of every project in the given tables (row count and max id per table). extra is mixed into
+# every fingerprint, e.g. a filter the partial results depend on.
+def get_project_fingerprints(tables, extra=''):
+    states = [get_project_states(table) for table in sorted(set(tables))]
+    project_ids = sorted(set().union(*states))
+    return {project_id: hashlib.sha1('\n'.join([extra] + [table_states.get(project_id, '-')
+                                                          for table_states in states]).encode('utf-8')).hexdigest()[:16]
+            for project_id in project_ids}
+
+
+def project_filter(project_ids):
+    return None if project_ids is None else [('project_id', 'in', [int(project_id) for project_id in project_ids])]
+
+
+# The tasks of an iterator (streaming mode), appending the project of each to project_ids as it is taken
+def noting_projects(tasks, project_ids):
+    for task in tasks:
+        project_ids.append(task[0])
+        yield task
+
+
+# (project id, partial result of function) for every project that has rows in projects_table, in order of project id.
+# make_tasks(project_ids) loads the data of the given projects, or of all projects for None, and returns one task per
+# project in order, the project id first. Without incremental mode it is called once for all projects; in incremental
+# mode only for the projects without a partial stored for their current rows in the tables, and the new partials are
+# stored.
+def map_projects_incrementally(name, function, projects_table, tables, make_tasks, extra=''):
+    if not incremental:
+        tasks = make_tasks(None)
+        if isinstance(tasks, list):
+            return list(zip([task[0] for task in tasks], map_projects(function, tasks)))
+        project_ids = list()
+        results = map_projects(function, noting_projects(tasks, project_ids))
+        return list(zip(project_ids, results))
+
+    fingerprints = get_project_fingerprints(tables, extra)
+    params = {'code': digest(inspect.getsource(function))}
+    project_ids = sorted(get_project_states(projects_table))
+    partials = dict()
+    missing = list()
+    for project_id in project_ids:
+        hit, partial = lookup(name, dict(params, project_id=project_id), fingerprints[project_id])
+        if hit:
+            partials[project_id] = partial
+        else:
+            missing.append(project_id)
+
+    print('{}: {} of {} projects to compute'.format(name, len(missing), len(project_ids)))
+    if missing:
+        for project_id, partial in zip(missing, map_projects(function, make_tasks(missing))):
+            store(name, partial, dict(params, project_id=project_id), fingerprints[project_id])
+            partials[project_id] = partial
+    return [(project_id, partials[project_id]) for project_id in project_ids]
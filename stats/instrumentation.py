@@ -0,0 +1,254 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# With ANALYSIS_INSTRUMENT=1 every stage of a run records its wall time, the rows it got and produced and how much the
+# memory allocated by Python grew, per project where it works on one. The records and a summary of the slowest stages
+# and projects are written to ANALYSIS_INSTRUMENT_OUTPUT (.json, or .csv) when the run ends. Turned off, stage() hands
+# out one shared object that records nothing.
+enabled = os.environ.get('ANALYSIS_INSTRUMENT', '0') == '1'
+output_path = os.environ.get('ANALYSIS_INSTRUMENT_OUTPUT', 'instrumentation.json')
+
+record_fields = ['stage', 'project_id', 'detail', 'parent', 'depth', 'outermost', 'seconds', 'rows_in', 'rows_out',
+                 'memory_delta_mb', 'started', 'pid', 'error']
+records = list()
+records_lock = threading.Lock()
+# stages open in the current thread, innermost last
+open_stages = threading.local()
+exporting_pid = None
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+    if enabled:
+        register_export()
+
+
+# Writes the records when the process that turned instrumentation on exits, not when a worker process does
+def register_export():
+    global exporting_pid
+    if exporting_pid is None:
+        exporting_pid = os.getpid()
+        atexit.register(export_at_exit)
+
+
+def export_at_exit():
+    if os.getpid() == exporting_pid and records:
+        export(output_path)
+        print_summary()
+
+
+def get_stack():
+    if not hasattr(open_stages, 'stack'):
+        open_stages.stack = list()
+    return open_stages.stack
+
+
+def count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(count_rows(item) or 0 for item in value if isinstance(item, (pd.DataFrame, pd.Series))) or None
+    return None
+
+
+class Stage(object):
+    def __init__(self, name, project_id=None, detail=None, rows_in=None):
+        self.name = name
+        self.project_id = None if project_id is None else int(project_id)
+        self.detail = detail
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = get_stack()
+        self.parent = stack[-1] if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.memory = tracemalloc.get_traced_memory()[0]
+        self.started = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        memory_delta = tracemalloc.get_traced_memory()[0] - self.memory
+        get_stack().pop()
+        record = {
+            'stage': self.name, 'project_id': self.project_id, 'detail': self.detail,
+            'parent': self.parent.name if self.parent is not None else None, 'depth': self.depth,
+            # the stages nested in a stage of the same project are part of its time already
+            'outermost': self.project_id is not None and (self.parent is None or
+                                                          self.parent.project_id != self.project_id),
+            'seconds': seconds, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'memory_delta_mb': memory_delta / 1024. ** 2, 'started': self.started, 'pid': os.getpid(),
+            'error': exc_type.__name__ if exc_type is not None else None,
+        }
+        with records_lock:
+            records.append(record)
+        return False
+
+
+class NoStage(object):
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+no_stage = NoStage()
+
+
+# with stage('read_query', detail=table) as current: ...; current.rows_out = len(df)
+def stage(name, project_id=None, detail=None, rows_in=None):
+    if not enabled:
+        return no_stage
+    return Stage(name, project_id, detail, rows_in)
+
+
+def instrument(function, per_project):
+    @functools.wraps(function)
+    def instrumented(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        rows_in = sum(count_rows(arg) or 0 for arg in args if isinstance(arg, (pd.DataFrame, pd.Series)))
+        with Stage(function.__name__, args[0] if per_project and args else None, rows_in=rows_in) as current:
+            result = function(*args, **kwargs)
+            current.rows_out = count_rows(result)
+        return result
+    return instrumented
+
+
+# Records every call of the decorated function as a stage named after it, with the rows of its data frame arguments
+# and of its result
+def timed(function):
+    return instrument(function, False)
+
+
+# Like timed, for functions that work on one project, given by their first argument
+def per_project(function):
+    return instrument(function, True)
+
+
+# Runs function(*args) and returns its result with the stages it recorded, when running in a worker process of
+# parent_pid. In the parent process itself the stages are recorded in place.
+def collect(function, parent_pid, *args):
+    if os.getpid() == parent_pid:
+        return function(*args), list()
+    global enabled
+    enabled = True
+    with records_lock:
+        # records of an earlier task, or inherited from the parent when forked
+        del records[:]
+    result = function(*args)
+    with records_lock:
+        collected = list(records)
+        del records[:]
+    return result, collected
+
+
+def add_collected(outcome):
+    result, collected = outcome
+    with records_lock:
+        records.extend(collected)
+    return result
+
+
+# executor.submit(function, *args) that brings the stages recorded by a worker process back with the result, which
+# get_result(future) then returns
+def submit(executor, function, *args):
+    if not enabled:
+        return executor.submit(function, *args)
+    return executor.submit(collect, function, os.getpid(), *args)
+
+
+def get_result(future):
+    if not enabled:
+        return future.result()
+    return add_collected(future.result())
+
+
+# list(executor.map(function, *iterables)), bringing back the stages of the worker processes like submit
+def map_collecting(executor, function, *iterables):
+    if not enabled:
+        return list(executor.map(function, *iterables))
+    return [add_collected(outcome) for outcome in
+            executor.map(functools.partial(collect, function, os.getpid()), *iterables)]
+
+
+def get_records():
+    with records_lock:
+        return pd.DataFrame(list(records), columns=record_fields)
+
+
+# Time, calls, rows and largest memory growth per stage, slowest first
+def get_stage_summary(df=None):
+    df = get_records() if df is None else df
+    grouped = df.groupby('stage')
+    return pd.DataFrame({
+        'calls': grouped.size(), 'seconds': grouped['seconds'].sum(), 'max_seconds': grouped['seconds'].max(),
+        'rows_in': grouped['rows_in'].sum(), 'rows_out': grouped['rows_out'].sum(),
+        'max_memory_delta_mb': grouped['memory_delta_mb'].max(),
+    }).sort_values('seconds', ascending=False)
+
+
+# Time spent on every project, with the stage that took longest on it, slowest first
+def get_project_summary(df=None):
+    df = get_records() if df is None else df
+    df = df[df['outermost'].astype(bool)].astype({'project_id': 'int64'})
+    grouped = df.groupby('project_id')
+    slowest = df.loc[grouped['seconds'].idxmax()].set_index('project_id')
+    return pd.DataFrame({
+        'seconds': grouped['seconds'].sum(), 'stages': grouped.size(), 'rows_in': grouped['rows_in'].sum(),
+        'rows_out': grouped['rows_out'].sum(), 'slowest_stage': slowest['stage'],
+        'slowest_stage_seconds': slowest['seconds'],
+    }).sort_values('seconds', ascending=False)
+
+
+def json_value(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+# Writes the records to a .json file, together with the stage and project summaries, or to a .csv file, with the
+# summaries next to it in <name>_stages.csv and <name>_projects.csv
+def export(path):
+    df = get_records()
+    stages = get_stage_summary(df)
+    projects = get_project_summary(df)
+    if path.endswith('.csv'):
+        base = path[:-len('.csv')]
+        df.to_csv(path, index=False)
+        stages.to_csv(base + '_stages.csv')
+        projects.to_csv(base + '_projects.csv')
+    else:
+        with open(path, 'w') as open_w:
+            json.dump({'records': df.astype(object).where(df.notnull(), None).to_dict('records'),
+                       'stages': stages.reset_index().to_dict('records'),
+                       'projects': projects.reset_index().to_dict('records')}, open_w, indent=1, default=json_value)
+    print('Wrote {} instrumentation records to {}'.format(len(df), path))
+
+
+def print_summary(top=10):
+    df = get_records()
+    print('Slowest stages:')
+    print(get_stage_summary(df).head(top).to_string())
+    projects = get_project_summary(df)
+    if len(projects):
+        print('Slowest projects:')
+        print(projects.head(top).to_string())
+
+
+if enabled:
+    register_export()
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+
+# Whether [start, start + length] of region 1 and of region 2 intersect, touching ends included, on whole arrays.
+# Comparisons against NaN are False, so a missing line number counts as intersecting.
+def regions_intersect_mask(region_1_start, region_1_length, region_2_start, region_2_length):
+    region_1_start = np.asarray(region_1_start, dtype=float)
+    region_2_start = np.asarray(region_2_start, dtype=float)
+    return ~((region_1_start + np.asarray(region_1_length, dtype=float) < region_2_start) |
+             (region_2_start + np.asarray(region_2_length, dtype=float) < region_1_start))
+
+
+# Codes of the values of two columns in one numbering, with 0 for missing values. Categorical columns are numbered
+# through their codes: as they are when they share their categories (see encoding.py), through a mapping of their
+# categories otherwise.
+def joint_codes(values_1, values_2):
+    if pd.api.types.is_categorical_dtype(values_1) and pd.api.types.is_categorical_dtype(values_2):
+        categories_1 = values_1.cat.categories
+        categories_2 = values_2.cat.categories
+        codes_1 = values_1.cat.codes.to_numpy().astype(np.int64)
+        codes_2 = values_2.cat.codes.to_numpy().astype(np.int64)
+        if not categories_1.equals(categories_2):
+            category_codes = pd.factorize(np.concatenate([categories_1.to_numpy(dtype=object),
+                                                          categories_2.to_numpy(dtype=object)]))[0]
+            # code -1 (missing) indexes the appended -1
+            codes_1 = np.append(category_codes[:len(categories_1)], -1)[codes_1]
+            codes_2 = np.append(category_codes[len(categories_1):], -1)[codes_2]
+        return codes_1 + 1, codes_2 + 1
+    codes = pd.factorize(np.concatenate([np.asarray(values_1, dtype=object),
+                                         np.asarray(values_2, dtype=object)]))[0].astype(np.int64) + 1
+    return codes[:len(values_1)], codes[len(values_1):]
+
+
+# Columns the involvement relation needs from conflicting_region_history and refactoring_region
+involvement_crh_columns = ['id', 'project_id', 'conflicting_region_id', 'merge_commit_id', 'commit_hash',
+                           'merge_parent', 'old_path', 'old_start_line', 'old_length', 'new_path', 'new_start_line',
+                           'new_length']
+involvement_rr_columns = ['id', 'project_id', 'commit_hash', 'type', 'path', 'start_line', 'length', 'refactoring_id',
+                          'refactoring_commit_id']
+
+# Conflicting region history columns that hold the region touched by source ('s') and destination ('d') refactoring
+# regions.
+region_columns = [('s', 'old_path', 'old_start_line', 'old_length'),
+                  ('d', 'new_path', 'new_start_line', 'new_length')]
+
+
+def expand_ranges(lo, hi):
+    counts = np.maximum(hi - lo, 0)
+    owners = np.repeat(np.arange(len(lo)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return owners, positions
+
+
+# Integer code per (commit_hash, path) over both sides. Missing values get a code of their own, so that they still
+# match each other like they do in pd.merge: a region with no path involves the regions with no path.
+def factorize_keys(crh_commits, crh_paths, rr_commits, rr_paths):
+    commit_codes = np.concatenate(joint_codes(crh_commits, rr_commits))
+    path_codes = np.concatenate(joint_codes(crh_paths, rr_paths))
+    keys = pd.factorize(commit_codes * (path_codes.max(initial=0) + 1) + path_codes)[0].astype(np.int64)
+    return keys[:len(crh_commits)], keys[len(crh_commits):]
+
+
+# Candidate pairs of same-key regions whose start lies inside the other region. With non-negative lengths these are
+# exactly the intersecting pairs, and with negative ones they are a superset of them, so callers still run the exact
+# test on the candidates.
+def sweep_candidates(crh_keys, crh_starts, crh_ends, rr_keys, rr_starts, rr_ends):
+    offset = min(np.min(crh_starts, initial=0), np.min(crh_ends, initial=0),
+                 np.min(rr_starts, initial=0), np.min(rr_ends, initial=0))
+    span = max(np.max(crh_starts, initial=0), np.max(crh_ends, initial=0),
+               np.max(rr_starts, initial=0), np.max(rr_ends, initial=0)) - offset + 1
+
+    crh_order = np.lexsort((crh_starts, crh_keys))
+    crh_sorted = (crh_keys * span + crh_starts - offset)[crh_order]
+    rr_order = np.lexsort((rr_starts, rr_keys))
+    rr_sorted = (rr_keys * span + rr_starts - offset)[rr_order]
+
+    # refactoring regions starting within [crh start, crh end]
+    lo = np.searchsorted(rr_sorted, crh_keys * span + crh_starts - offset, side='left')
+    hi = np.searchsorted(rr_sorted, crh_keys * span + crh_ends - offset, side='right')
+    crh_owners, rr_positions = expand_ranges(lo, hi)
+    # conflicting region histories starting within (rr start, rr end]
+    lo = np.searchsorted(crh_sorted, rr_keys * span + rr_starts - offset, side='right')
+    hi = np.searchsorted(crh_sorted, rr_keys * span + rr_ends - offset, side='right')
+    rr_owners, crh_positions = expand_ranges(lo, hi)
+
+    return (np.concatenate([crh_owners, crh_order[crh_positions]]),
+            np.concatenate([rr_order[rr_positions], rr_owners]))
+
+
+def same_key_candidates(crh_keys, rr_keys):
+    pairs = pd.merge(pd.DataFrame({'key': crh_keys, 'crh': np.arange(len(crh_keys))}),
+                     pd.DataFrame({'key': rr_keys, 'rr': np.arange(len(rr_keys))}), on='key')
+    return pairs['crh'].to_numpy(), pairs['rr'].to_numpy()
+
+
+# Codes numbering the distinct values, missing values included, in order of first appearance
+def first_appearance_codes(values):
+    if pd.api.types.is_categorical_dtype(values):
+        # category codes are plain integers, -1 included
+        return pd.factorize(values.cat.codes.to_numpy())[0]
+    values = np.asarray(values, dtype=object)
+    codes = pd.factorize(values)[0]
+    missing = codes < 0
+    if missing.any():
+        first_missing = np.argmax(missing)
+        missing_code = codes[:first_missing].max(initial=-1) + 1
+        codes[codes >= missing_code] += 1
+        codes[missing] = missing_code
+    return codes
+
+
+# Candidate (crh position, typed position) pairs of the conflicting region histories and the refactoring regions at
+# the typed positions of rrs, with their line numbers
+def typed_candidates(crh, rrs, typed, path_column, start_column, length_column):
+    crh_keys, rr_keys = factorize_keys(crh['commit_hash'], crh[path_column],
+                                       rrs['commit_hash'].iloc[typed], rrs['path'].iloc[typed])
+    crh_starts = crh[start_column].to_numpy(dtype=float)
+    crh_lengths = crh[length_column].to_numpy(dtype=float)
+    rr_starts = rrs['start_line'].to_numpy(dtype=float)[typed]
+    rr_lengths = rrs['length'].to_numpy(dtype=float)[typed]
+
+    # The sweep needs integer lines; rows with a missing line number are paired with every same-key region instead.
+    crh_valid = ~(np.isnan(crh_starts) | np.isnan(crh_lengths))
+    rr_valid = ~(np.isnan(rr_starts) | np.isnan(rr_lengths))
+    crh_index = np.flatnonzero(crh_valid)
+    rr_index = np.flatnonzero(rr_valid)
+    crh_candidates, rr_candidates = sweep_candidates(
+        crh_keys[crh_index], crh_starts[crh_index].astype(np.int64),
+        (crh_starts[crh_index] + crh_lengths[crh_index]).astype(np.int64),
+        rr_keys[rr_index], rr_starts[rr_index].astype(np.int64),
+        (rr_starts[rr_index] + rr_lengths[rr_index]).astype(np.int64))
+    crh_candidates = [crh_index[crh_candidates]]
+    rr_candidates = [rr_index[rr_candidates]]
+    if not crh_valid.all():
+        crh_invalid = np.flatnonzero(~crh_valid)
+        left, right = same_key_candidates(crh_keys[crh_invalid], rr_keys)
+        crh_candidates.append(crh_invalid[left])
+        rr_candidates.append(right)
+    if not rr_valid.all():
+        rr_invalid = np.flatnonzero(~rr_valid)
+        left, right = same_key_candidates(crh_keys[crh_index], rr_keys[rr_invalid])
+        crh_candidates.append(crh_index[left])
+        rr_candidates.append(rr_invalid[right])
+    return (np.concatenate(crh_candidates), np.concatenate(rr_candidates),
+            crh_starts, crh_lengths, rr_starts, rr_lengths)
+
+
+# Positions of the involved (conflicting_region_history, refactoring_region) pairs, in the order pd.merge on commit_hash
+# would produce them: grouped by commit in order of first appearance, then by position on each side.
+def involved_positions(crh, rrs):
+    crh_positions = list()
+    rr_positions = list()
+    for region_type, path_column, start_column, length_column in region_columns:
+        typed = np.flatnonzero((rrs['type'] == region_type).to_numpy())
+        with stage('involvement_candidates', detail=region_type, rows_in=len(crh) + len(typed)) as current:
+            crh_candidates, rr_candidates, crh_starts, crh_lengths, rr_starts, rr_lengths = typed_candidates(
+                crh, rrs, typed, path_column, start_column, length_column)
+            current.rows_out = len(crh_candidates)
+
+        with stage('involvement_filter', detail=region_type, rows_in=len(crh_candidates)) as current:
+            intersecting = regions_intersect_mask(crh_starts[crh_candidates], crh_lengths[crh_candidates],
+                                                  rr_starts[rr_candidates], rr_lengths[rr_candidates])
+            current.rows_out = int(intersecting.sum())
+        crh_positions.append(crh_candidates[intersecting])
+        rr_positions.append(typed[rr_candidates[intersecting]])
+
+    crh_positions = np.concatenate(crh_positions).astype(np.int64)
+    rr_positions = np.concatenate(rr_positions).astype(np.int64)
+    commit_order = first_appearance_codes(crh['commit_hash'])
+    order = np.lexsort((rr_positions, crh_positions, commit_order[crh_positions]))
+    return crh_positions[order], rr_positions[order]
+
+
+# Interval join on (commit_hash, path): the rows of pd.merge(crh, rrs, on='commit_hash') where a source ('s') or
+# destination ('d') refactoring region lies on the same path as the old or new region of the conflicting region history
+# and the two intersect, without building the per-commit cross product first.
+def join_involved(crh, rrs):
+    crh_positions, rr_positions = involved_positions(crh, rrs)
+    left = crh.iloc[crh_positions].reset_index(drop=True)
+    right = rrs.drop(columns='commit_hash').iloc[rr_positions].reset_index(drop=True)
+    overlapping = [column for column in left.columns if column in right.columns]
+    left = left.rename(columns={column: column + '_x' for column in overlapping})
+    right = right.rename(columns={column: column + '_y' for column in overlapping})
+    return pd.concat([left, right], axis=1)
@@ -0,0 +1,190 @@
+import argparse
+import inspect
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import data_resolver
+import instrumentation
+import parallel
+import plotter
+from data_resolver import analysis_tables, frame_sources, involvement_tables
+from instrumentation import stage
+
+# Computes derived data into the cache as a graph of jobs: the involvement relation, the data frames of
+# data_resolver.get_data_frame (named without get_) and the reduced data of the figures of plotter.py (figure:<name>).
+# A job runs once the jobs it needs are done, independent jobs run at the same time, and a job whose result is cached
+# already is skipped together with whatever only it needed.
+involvement_job = 'involvement'
+figure_prefix = 'figure:'
+
+
+def get_frame_names():
+    names = set(frame_sources) | {df_name for df_name, _ in plotter.figure_sources.values()}
+    pending = list(names)
+    while pending:
+        for dependency in get_frame_dependencies(pending.pop()):
+            if dependency not in names:
+                names.add(dependency)
+                pending.append(dependency)
+    return sorted(names)
+
+
+# The frames a producer reads through get_data_frame
+def get_frame_dependencies(df_name):
+    return re.findall(r"get_data_frame\('(\w+)'", inspect.getsource(getattr(data_resolver, 'get_' + df_name)))
+
+
+def get_all_jobs():
+    return [involvement_job] + get_frame_names() + [figure_prefix + figure for figure in plotter.figure_sources]
+
+
+def get_dependencies(job):
+    if job == involvement_job:
+        return []
+    if job.startswith(figure_prefix):
+        return [plotter.figure_sources[job[len(figure_prefix):]][0]]
+    dependencies = get_frame_dependencies(job)
+    if set(involvement_tables) <= set(frame_sources.get(job, analysis_tables)):
+        dependencies.append(involvement_job)
+    return dependencies
+
+
+def is_cached(job):
+    if job == involvement_job:
+        return data_resolver.is_involvement_cached()
+    if job.startswith(figure_prefix):
+        return plotter.is_figure_cached(job[len(figure_prefix):])
+    return data_resolver.is_data_frame_cached(job)
+
+
+def check_job(job):
+    if job not in get_all_jobs():
+        raise ValueError('Unknown job {}, expected one of: {}'.format(job, ', '.join(get_all_jobs())))
+
+
+# The jobs to run for the targets with the jobs each of them needs, leaving out cached jobs and what only they need
+def get_graph(targets):
+    graph = dict()
+    pending = list(targets)
+    while pending:
+        job = pending.pop()
+        check_job(job)
+        if job in graph or is_cached(job):
+            continue
+        graph[job] = get_dependencies(job)
+        pending.extend(graph[job])
+    for job in graph:
+        graph[job] = [dependency for dependency in graph[job] if dependency in graph]
+    check_acyclic(graph)
+    return graph
+
+
+def check_acyclic(graph):
+    done = set()
+    visiting = set()
+
+    def visit(job, path):
+        if job in visiting:
+            raise ValueError('Cyclic dependency: {}'.format(' -> '.join(path + [job])))
+        if job not in done:
+            visiting.add(job)
+            for dependency in graph[job]:
+                visit(dependency, path + [job])
+            visiting.remove(job)
+            done.add(job)
+
+    for job in graph:
+        visit(job, [])
+
+
+def run_job(job, workers):
+    parallel.set_workers(workers)
+    start = time.perf_counter()
+    with stage('job', detail=job):
+        if job == involvement_job:
+            data_resolver.get_involvement()
+        elif job.startswith(figure_prefix):
+            plotter.get_figure_data(job[len(figure_prefix):])
+        else:
+            data_resolver.get_data_frame(job)
+    return time.perf_counter() - start
+
+
+# Runs the jobs of the graph, up to jobs of them at a time in worker processes, each with its share of the
+# ANALYSIS_WORKERS processes for its own per-project loops. A failed job fails the jobs that need it; the others still
+# run. Returns the seconds of every job that ran and the failed jobs.
+def run_graph(graph, jobs=None):
+    jobs = max(1, min(jobs or parallel.workers, len(graph) or 1))
+    job_workers = max(1, parallel.workers // jobs)
+    seconds = dict()
+    failed = dict()
+    waiting = dict((job, set(dependencies)) for job, dependencies in graph.items())
+    running = dict()
+    with ThreadPoolExecutor(max_workers=1) if jobs <= 1 else ProcessPoolExecutor(max_workers=jobs) as executor:
+        while waiting or running:
+            for job in sorted(job for job, dependencies in waiting.items() if not dependencies):
+                del waiting[job]
+                running[instrumentation.submit(executor, run_job, job, job_workers)] = job
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    seconds[job] = instrumentation.get_result(future)
+                    print('Done {} in {:.1f}s ({} of {})'.format(job, seconds[job], len(seconds), len(graph)))
+                except Exception as error:
+                    failed[job] = error
+                    print('Failed {}: {!r}'.format(job, error))
+                for dependencies in waiting.values():
+                    dependencies.discard(job)
+            fail_waiting_on(waiting, failed, graph)
+    return seconds, failed
+
+
+# Fails the jobs waiting on a failed job, and on those in turn
+def fail_waiting_on(waiting, failed, graph):
+    skipped = True
+    while skipped:
+        skipped = False
+        for job in list(waiting):
+            failed_dependency = next((dependency for dependency in graph[job] if dependency in failed), None)
+            if failed_dependency is not None:
+                failed[job] = 'needs {}'.format(failed_dependency)
+                print('Skipped {}: needs {}'.format(job, failed_dependency))
+                del waiting[job]
+                skipped = True
+
+
+def print_jobs(targets):
+    for job in targets:
+        print('{:<80} {:<8} {}'.format(job, 'cached' if is_cached(job) else '-', ', '.join(get_dependencies(job))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compute the derived data frames and figure data into the cache, independent ones in parallel.')
+    parser.add_argument('targets', nargs='*',
+                        help='jobs to run: involvement, a data frame name or figure:<figure name>')
+    parser.add_argument('--all', action='store_true', help='run every job')
+    parser.add_argument('--figures', action='store_true', help='run the jobs for all figures of plotter.py')
+    parser.add_argument('--jobs', type=int, help='jobs to run at a time (default: ANALYSIS_WORKERS)')
+    parser.add_argument('--list', action='store_true',
+                        help='list the jobs with whether they are cached and what they need, and exit')
+    args = parser.parse_args()
+
+    targets = list(args.targets)
+    if args.all:
+        targets = get_all_jobs()
+    elif args.figures:
+        targets += [figure_prefix + figure for figure in plotter.figure_sources]
+    if args.list:
+        print_jobs(targets or get_all_jobs())
+        sys.exit(0)
+    if not targets:
+        parser.error('give the jobs to run, --figures or --all')
+
+    graph = get_graph(targets)
+    print('{} jobs to run for {} target(s), the others are cached'.format(len(graph), len(set(targets))))
+    seconds, failed = run_graph(graph, args.jobs)
+    sys.exit(1 if failed else 0)
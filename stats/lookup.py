@@ -0,0 +1,23 @@
+# Hash indexes over the loaded frames, for the extraction loops that look up one merge commit or refactoring per row
+# of the involvement table.
+
+
+# Maps the key of every row (a value, or a tuple of values for several key columns) to the values of value_columns in
+# the first row with that key, like taking .iloc[0] of a boolean mask on the key columns.
+def index_rows(df, key_columns, value_columns):
+    first_rows = df.drop_duplicates(subset=key_columns)
+    if len(key_columns) == 1:
+        keys = first_rows[key_columns[0]]
+    else:
+        keys = zip(*[first_rows[column] for column in key_columns])
+    return dict(zip(keys, zip(*[first_rows[column] for column in value_columns])))
+
+
+# (project_id, merge_commit_id) -> (merge commit hash, parent 1, parent 2)
+def index_merge_commits(merge_commits):
+    return index_rows(merge_commits, ['project_id', 'id'], ['commit_hash', 'parent_1', 'parent_2'])
+
+
+# (project_id, refactoring_id) -> (merge parent, merge commit id) of the first involved conflicting region history
+def index_involved_refactorings(involved_crh_rr):
+    return index_rows(involved_crh_rr, ['project_id_x', 'refactoring_id'], ['merge_parent', 'merge_commit_id'])
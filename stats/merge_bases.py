@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from git import GitCommandError
+
+from cache import cache_dir
+
+# Resolved merge bases survive across runs in this SQLite file, keyed by repository and pair of parents
+merge_base_cache_path = os.environ.get('ANALYSIS_MERGE_BASE_CACHE', os.path.join(cache_dir, 'merge_bases.sqlite'))
+# Number of git merge-base processes run at the same time in one repository
+git_workers = int(os.environ.get('ANALYSIS_GIT_WORKERS', '4'))
+# Number of repositories worked on at the same time by drivers going through several projects
+git_repositories = int(os.environ.get('ANALYSIS_GIT_REPOSITORIES', '2'))
+
+merge_bases = dict()
+merge_bases_lock = threading.Lock()
+loaded_repos = set()
+
+
+def repo_key(repo):
+    return os.path.abspath(repo.working_tree_dir or repo.git_dir)
+
+
+def connect():
+    directory = os.path.dirname(merge_base_cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(merge_base_cache_path, timeout=60)
+    connection.execute('create table if not exists merge_base (repo text not null, parent_1 text not null, '
+                       'parent_2 text not null, merge_base text, primary key (repo, parent_1, parent_2))')
+    return connection
+
+
+def load_repo(key):
+    if key in loaded_repos:
+        return
+    with closing(connect()) as connection:
+        rows = connection.execute('select parent_1, parent_2, merge_base from merge_base where repo = ?', (key,))
+        with merge_bases_lock:
+            for parent1, parent2, merge_base in rows:
+                merge_bases[(key, parent1, parent2)] = merge_base
+            loaded_repos.add(key)
+
+
+def store(key, resolved):
+    with closing(connect()) as connection, connection:
+        connection.executemany('insert or replace into merge_base values (?, ?, ?, ?)',
+                               [(key, parent1, parent2, merge_base)
+                                for (parent1, parent2), merge_base in resolved.items()])
+
+
+# Same result as repo.merge_base(parent1, parent2)[0], None when the parents have no common ancestor
+def run_merge_base(repo, parent1, parent2):
+    try:
+        output = repo.git.merge_base(parent1, parent2)
+    except GitCommandError as error:
+        if error.status == 1:
+            return None
+        raise
+    lines = output.splitlines()
+    return lines[0].strip() if lines else None
+
+
+# Merge bases of all the given (parent1, parent2) pairs of a repository. Each distinct pair is resolved at most once:
+# pairs are looked up in memory and in the on-disk cache first, and the remaining ones are resolved concurrently and
+# stored for later runs.
+def resolve_merge_bases(repo, pairs, workers=None):
+    key = repo_key(repo)
+    load_repo(key)
+    pairs = list(dict.fromkeys((str(parent1), str(parent2)) for parent1, parent2 in pairs))
+    missing = [pair for pair in pairs if (key,) + pair not in merge_bases]
+
+    if missing:
+        print('Resolving {} merge bases in {}'.format(len(missing), key))
+        workers = git_workers if workers is None else workers
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as executor:
+            resolved = dict(zip(missing, executor.map(lambda pair: run_merge_base(repo, *pair), missing)))
+        store(key, resolved)
+        with merge_bases_lock:
+            for pair, merge_base in resolved.items():
+                merge_bases[(key,) + pair] = merge_base
+
+    return {pair: merge_bases[(key,) + pair] for pair in pairs}
+
+
+def get_merge_base(repo, parent1, parent2):
+    return resolve_merge_bases(repo, [(parent1, parent2)])[(str(parent1), str(parent2))]
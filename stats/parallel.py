@@ -0,0 +1,49 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import instrumentation
+
+# Number of worker processes used for the per-project loops. 1 runs everything in the calling process.
+workers = int(os.environ.get('ANALYSIS_WORKERS', '1'))
+
+
+def set_workers(count):
+    global workers
+    workers = max(1, int(count))
+
+
+# Calls function(*task) for every task and returns the results in the order of the tasks, whatever order the workers
+# finish in, so that the combined frames are the same as in a serial run. Stages the workers record (see
+# instrumentation.py) come back with the results. Tasks given as an iterator (streaming mode) are drawn as the workers
+# take them, with at most window tasks per worker submitted at a time.
+def map_projects(function, tasks, window=2):
+    if not isinstance(tasks, (list, tuple)):
+        return map_streamed(function, tasks, window)
+    tasks = list(tasks)
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return instrumentation.map_collecting(executor, function, *zip(*tasks))
+
+
+def map_streamed(function, tasks, window):
+    if workers <= 1:
+        return [function(*task) for task in tasks]
+    results = list()
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for task in tasks:
+            if len(pending) >= window * workers:
+                results.append(instrumentation.get_result(pending.popleft()))
+            pending.append(instrumentation.submit(executor, function, *task))
+        while pending:
+            results.append(instrumentation.get_result(pending.popleft()))
+    return results
+
+
+# Executor for the data frame stages of a pipeline: the worker processes, or a single thread when running serially
+def get_executor():
+    if workers <= 1:
+        return ThreadPoolExecutor(max_workers=1)
+    return ProcessPoolExecutor(max_workers=workers)
@@ -1,19 +1,139 @@
+import argparse
+import inspect
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 import matplotlib.ticker as ticker
 
 
-from data_resolver import get_data_frame
+import cache
+import data_resolver
+from cache import digest, get_or_compute
+from data_resolver import analysis_tables, frame_sources, get_data_frame, get_tables_fingerprint
+
+
+# What ax.boxplot(values, showmeans=True) draws, for ax.bxp: quartiles, mean, whiskers at the furthest values within
+# 1.5 IQR of the box and the distinct values beyond them as fliers, so that the figure needs no per-row data.
+def box_stats(values):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'mean': np.nan, 'med': np.nan, 'q1': np.nan, 'q3': np.nan, 'whislo': np.nan, 'whishi': np.nan,
+                'fliers': np.array([])}
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    high = values[values <= q3 + 1.5 * iqr]
+    low = values[values >= q1 - 1.5 * iqr]
+    whishi = q3 if len(high) == 0 or high.max() < q3 else high.max()
+    whislo = q1 if len(low) == 0 or low.min() > q1 else low.min()
+    return {'mean': values.mean(), 'med': med, 'q1': q1, 'q3': q3, 'whislo': whislo, 'whishi': whishi,
+            'fliers': np.unique(values[(values < whislo) | (values > whishi)])}
+
+
+# Number of rows per distinct combination of the columns, in a 'frequency' column
+def binned_counts(df, columns):
+    return df.groupby(columns).size().reset_index().rename(columns={0: 'frequency'})
+
+
+def conflicting_region_by_involved_refactoring_data(crs_by_involved_refactoring):
+    return [box_stats(crs_by_involved_refactoring[crs_by_involved_refactoring['involved_refactorings'] > 0]['size']),
+            box_stats(crs_by_involved_refactoring[crs_by_involved_refactoring['involved_refactorings'] == 0]['size'])]
+
+
+def number_of_conflicting_region_histories_by_involved_per_merge_commit_data(df):
+    return [box_stats(df[df['involved_refs'] > 0]['crh']), box_stats(df[df['involved_refs'] == 0]['crh'])]
+
+
+def number_of_devs_by_involved_per_merge_commit_data(df):
+    return [box_stats(df[df['involved_refs'] > 0]['devs']), box_stats(df[df['involved_refs'] == 0]['devs'])]
+
+
+# The frequency of every (conflicting region size, refactoring size) pair, and the least squares line through all the
+# rows: weighting each pair by the square root of its frequency fits the same line as the rows themselves.
+def conflicting_region_size_by_involved_refactoring_size_data(crs_size_by_involved_refs_size):
+    crs_size_by_involved_refs_size = crs_size_by_involved_refs_size[crs_size_by_involved_refs_size['refactoring_size'] > 0]
+    plot_df = binned_counts(crs_size_by_involved_refs_size, ['conflicting_region_size', 'refactoring_size'])
+    b, m = np.polynomial.polynomial.polyfit(plot_df['conflicting_region_size'], plot_df['refactoring_size'], 1,
+                                            w=np.sqrt(plot_df['frequency']))
+    return plot_df, b, m
+
+
+def conflicting_merge_commit_by_merge_author_involvement_in_conflict_data(mg_by_author):
+    mg_by_author = mg_by_author.copy()
+    mg_by_author['percent_same_author'] = mg_by_author['crh_merge_author'] / mg_by_author['total_crh']
+    mg_involved_author_by_author_ref = mg_by_author[(mg_by_author.percent_same_author > 0) & (mg_by_author.crh_merge_author_involved_ref > 0)]['percent_same_author']
+    mg_involved_author_by_author_no_ref = mg_by_author[(mg_by_author.percent_same_author > 0) & (mg_by_author.crh_merge_author_involved_ref == 0)]['percent_same_author']
+    return [box_stats(mg_involved_author_by_author_ref), box_stats(mg_involved_author_by_author_no_ref)]
+
+
+# One row per project and type already
+def refactorings_by_refactoring_type_data(plot_df):
+    return plot_df.replace('overall', 'Overall').replace('involved', "Involved")
 
 
-def plot_conflicting_region_by_involved_refactoring():
-    crs_by_involved_refactoring = get_data_frame('conflicting_regions_by_count_of_involved_refactoring')
-    cr_size_with_involved = crs_by_involved_refactoring[crs_by_involved_refactoring['involved_refactorings'] > 0]['size'].tolist()
-    cr_size_without_involved = crs_by_involved_refactoring[crs_by_involved_refactoring['involved_refactorings'] == 0]['size'].tolist()
+def conflicting_regions_by_involved_refactorings_per_merge_commit_data(plot_df):
+    return binned_counts(plot_df, ['cr_count', 'involved_cr_count'])
+
+
+# Figure -> (data frame it is drawn from, function reducing the frame to what the figure shows)
+figure_sources = {
+    'conflicting_region_by_involved_refactoring': (
+        'conflicting_regions_by_count_of_involved_refactoring', conflicting_region_by_involved_refactoring_data),
+    'number_of_conflicting_region_histories_by_involved_per_merge_commit': (
+        'merge_commit_by_crh_and_devs_and_involved_refactorings',
+        number_of_conflicting_region_histories_by_involved_per_merge_commit_data),
+    'number_of_devs_by_involved_per_merge_commit': (
+        'merge_commit_by_crh_and_devs_and_involved_refactorings', number_of_devs_by_involved_per_merge_commit_data),
+    'conflicting_region_size_by_involved_refactoring_size': (
+        'conflicting_region_size_by_involved_refactoring_size',
+        conflicting_region_size_by_involved_refactoring_size_data),
+    'conflicting_merge_commit_by_merge_author_involvement_in_conflict': (
+        'conflicting_merge_commit_by_merge_author_involvement_in_conflict',
+        conflicting_merge_commit_by_merge_author_involvement_in_conflict_data),
+    'refactorings_by_refactoring_type': (
+        'refactorings_by_refactoring_type_split_by_involved', refactorings_by_refactoring_type_data),
+    'conflicting_regions_by_involved_refactorings_per_merge_commit': (
+        'conflicting_regions_by_involved_refactorings_per_merge_commit',
+        conflicting_regions_by_involved_refactorings_per_merge_commit_data),
+}
+
+
+# The reduced data of a figure, cached like the data frame it comes from, so that redrawing a figure reads a few
+# numbers instead of the frame
+def get_figure_entry(figure):
+    df_name, reduce_frame = figure_sources[figure]
+    key = {'code': digest(inspect.getsource(reduce_frame) +
+                          inspect.getsource(getattr(data_resolver, 'get_' + df_name)))}
+    return key, get_tables_fingerprint(frame_sources.get(df_name, analysis_tables))
+
+
+def is_figure_cached(figure):
+    key, fingerprint = get_figure_entry(figure)
+    return cache.contains('figure_' + figure, key, fingerprint)
+
+
+def get_figure_data(figure):
+    df_name, reduce_frame = figure_sources[figure]
+    key, fingerprint = get_figure_entry(figure)
+    return get_or_compute('figure_' + figure, lambda: reduce_frame(get_data_frame(df_name)), key, fingerprint)
+
+
+def save_figure(fig, file_name, directory, show):
+    fig.savefig(os.path.join(directory, file_name))
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def plot_conflicting_region_by_involved_refactoring(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('conflicting_region_by_involved_refactoring')
 
     fig, ax = plt.subplots()
-    ax.boxplot([cr_size_with_involved, cr_size_without_involved], showmeans=True)
+    ax.bxp(data, showmeans=True)
 
     ax.set_xticklabels(['With Involved Refactorings', 'Without Involved Refactorings'])
 
@@ -24,18 +144,15 @@ def plot_conflicting_region_by_involved_refactoring():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('conflicting_region_by_involved_refactoring.pdf')
-    plt.show()
-
+    save_figure(fig, 'conflicting_region_by_involved_refactoring.pdf', directory, show)
 
-def plot_number_of_conflicting_region_histories_by_involved_per_merge_commit():
-    df = get_data_frame('merge_commit_by_crh_and_devs_and_involved_refactorings')
 
-    crh_involved_count = df[df['involved_refs'] > 0]['crh'].tolist()
-    crh_not_involved_count = df[df['involved_refs'] == 0]['crh'].tolist()
+def plot_number_of_conflicting_region_histories_by_involved_per_merge_commit(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('number_of_conflicting_region_histories_by_involved_per_merge_commit')
 
     fig, ax = plt.subplots()
-    ax.boxplot([crh_involved_count, crh_not_involved_count], showmeans=True)
+    ax.bxp(data, showmeans=True)
 
     ax.set_xticklabels(['Conflicting Merge Scenarios\nwith Involved Refactorings',
                         'Conflicting Merge Scenarios\nwithout Involved Refactorings'])
@@ -46,18 +163,15 @@ def plot_number_of_conflicting_region_histories_by_involved_per_merge_commit():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('number_of_conflicting_region_histories_by_involved_per_merge_commit.pdf')
-    plt.show()
+    save_figure(fig, 'number_of_conflicting_region_histories_by_involved_per_merge_commit.pdf', directory, show)
 
 
-def plot_number_of_devs_by_involved_per_merge_commit():
-    df = get_data_frame('merge_commit_by_crh_and_devs_and_involved_refactorings')
-
-    devs_involved_count = df[df['involved_refs'] > 0]['devs'].tolist()
-    devs_not_involved_count = df[df['involved_refs'] == 0]['devs'].tolist()
+def plot_number_of_devs_by_involved_per_merge_commit(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('number_of_devs_by_involved_per_merge_commit')
 
     fig, ax = plt.subplots()
-    ax.boxplot([devs_involved_count, devs_not_involved_count], showmeans=True)
+    ax.bxp(data, showmeans=True)
 
     ax.set_xticklabels(['Conflicting Merge Scenarios\nwith Involved Refactorings',
                         'Conflicting Merge Scenarios\nwithout Involved Refactorings'])
@@ -69,16 +183,13 @@ def plot_number_of_devs_by_involved_per_merge_commit():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('number_of_devs_by_involved_per_merge_commit.pdf')
-    plt.show()
+    save_figure(fig, 'number_of_devs_by_involved_per_merge_commit.pdf', directory, show)
 
 
-def plot_conflicting_region_size_by_involved_refactoring_size():
-    crs_size_by_involved_refs_size = get_data_frame('conflicting_region_size_by_involved_refactoring_size')
-    crs_size_by_involved_refs_size = crs_size_by_involved_refs_size[crs_size_by_involved_refs_size['refactoring_size'] > 0]
-
-    plot_df = crs_size_by_involved_refs_size.groupby(['conflicting_region_size', 'refactoring_size']).size().reset_index().rename(columns={0: 'frequency'})
-    b, m = np.polynomial.polynomial.polyfit(crs_size_by_involved_refs_size['conflicting_region_size'], crs_size_by_involved_refs_size['refactoring_size'], 1)
+def plot_conflicting_region_size_by_involved_refactoring_size(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('conflicting_region_size_by_involved_refactoring_size')
+    plot_df, b, m = data
 
     fig, ax = plt.subplots()
     ax.scatter(x=plot_df['conflicting_region_size'], y=plot_df['refactoring_size'], s=plot_df['frequency'], alpha=.75)
@@ -94,27 +205,19 @@ def plot_conflicting_region_size_by_involved_refactoring_size():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('conflicting_region_size_by_involved_refactoring_size.pdf')
-    plt.show()
-
-
-def plot_conflicting_merge_commit_by_merge_author_involvement_in_conflict():
-    mg_by_author = get_data_frame('conflicting_merge_commit_by_merge_author_involvement_in_conflict')
-    mg_by_author['percent_same_author'] = mg_by_author['crh_merge_author'] / mg_by_author['total_crh']
-    mg_by_author['percent_commits_with_ref'] = mg_by_author['crh_involved_ref'] / mg_by_author['total_crh']
+    save_figure(fig, 'conflicting_region_size_by_involved_refactoring_size.pdf', directory, show)
 
-    percent_commits_with_ref_involved_author = mg_by_author[(mg_by_author.percent_same_author > 0)]['percent_commits_with_ref'].tolist()
-    percent_commits_with_ref_noninvolved_author = mg_by_author[(mg_by_author.percent_same_author == 0)]['percent_commits_with_ref'].tolist()
 
-    mg_involved_author_by_author_ref = mg_by_author[(mg_by_author.percent_same_author > 0) & (mg_by_author.crh_merge_author_involved_ref > 0)]['percent_same_author'].tolist()
-    mg_involved_author_by_author_no_ref = mg_by_author[(mg_by_author.percent_same_author > 0) & (mg_by_author.crh_merge_author_involved_ref == 0)]['percent_same_author'].tolist()
+def plot_conflicting_merge_commit_by_merge_author_involvement_in_conflict(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('conflicting_merge_commit_by_merge_author_involvement_in_conflict')
 
     # cr_size_with_involved = np.random.choice(cr_size_with_involved, 10000)
     # cr_size_without_involved = np.random.choice(cr_size_without_involved, 10000)
 
     fig, ax = plt.subplots()
     # axs[0].boxplot([percent_commits_with_ref_involved_author, percent_commits_with_ref_noninvolved_author], showmeans=True)
-    ax.boxplot([mg_involved_author_by_author_ref, mg_involved_author_by_author_no_ref], showmeans=True)
+    ax.bxp(data, showmeans=True)
 
     # axs[0].set_xticklabels(['Involved Merger', 'Non-involved Merger'])
     ax.set_xticklabels(['With Involved Refactorings', 'Without Involved Refactorings'])
@@ -131,12 +234,11 @@ def plot_conflicting_merge_commit_by_merge_author_involvement_in_conflict():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('conflicting_merge_commit_by_merge_author_involvement_in_conflict.pdf')
-    plt.show()
+    save_figure(fig, 'conflicting_merge_commit_by_merge_author_involvement_in_conflict.pdf', directory, show)
 
 
-def plot_refactorings_by_refactoring_type():
-    plot_df = get_data_frame('refactorings_by_refactoring_type_split_by_involved').replace('overall', 'Overall').replace('involved', "Involved")
+def plot_refactorings_by_refactoring_type(data=None, directory='.', show=True):
+    plot_df = get_figure_data('refactorings_by_refactoring_type') if data is None else data
 
     fig, ax = plt.subplots(figsize=(15, 6))
     sns.violinplot(x="refactoring_type", y="percent", hue="overall_or_involved", data=plot_df,
@@ -150,13 +252,13 @@ def plot_refactorings_by_refactoring_type():
     plt.setp(ax.xaxis.get_majorticklabels(), rotation=-45, ha="left", rotation_mode="anchor")
 
     fig.tight_layout()
-    plt.savefig('refactorings_by_refactoring_type.pdf')
-    plt.show()
+    save_figure(fig, 'refactorings_by_refactoring_type.pdf', directory, show)
 
 
-def plot_conflicting_regions_by_involved_refactorings_per_merge_commit():
-    plot_df = get_data_frame('conflicting_regions_by_involved_refactorings_per_merge_commit')
-    plot_df = plot_df.groupby(['cr_count', 'involved_cr_count']).size().reset_index().rename(columns={0: 'frequency'})
+def plot_conflicting_regions_by_involved_refactorings_per_merge_commit(data=None, directory='.', show=True):
+    if data is None:
+        data = get_figure_data('conflicting_regions_by_involved_refactorings_per_merge_commit')
+    plot_df = data.copy()
 
     fig, ax = plt.subplots(figsize=(6, 4.7))
 
@@ -189,17 +291,59 @@ def plot_conflicting_regions_by_involved_refactorings_per_merge_commit():
     fig.tight_layout()
 
     # plt.subplots_adjust(left=.15, right=.97)
-    plt.savefig('conflicting_regions_by_involved_refactorings_per_merge_commit.pdf')
-    plt.show()
-
-
-plot_functions = [x for x in dir() if x[:5] == 'plot_']
-print('Options available:')
-for i in range(len(plot_functions)):
-    print(str(i + 1) + '. ' + plot_functions[i])
-print(str(len(plot_functions) + 1) + '. Exit')
-while True:
-    inp = int(input('Choose an option: '))
-    if inp < 1 or inp > len(plot_functions):
-        break
-    locals()[plot_functions[inp - 1]]()
+    save_figure(fig, 'conflicting_regions_by_involved_refactorings_per_merge_commit.pdf', directory, show)
+
+
+# Draws one figure from its reduced data without a display, in a worker process of render_figures
+def render_figure(figure, data, directory):
+    plt.switch_backend('agg')
+    globals()['plot_' + figure](data, directory, show=False)
+    return figure
+
+
+# Draws the given figures, all by default, into directory. The data of the figures is computed (or read from the
+# cache) here one figure at a time, and only the reduced data goes to the worker processes that draw them.
+def render_figures(figures=None, directory='.', workers=None):
+    figures = figures or list(figure_sources)
+    os.makedirs(directory, exist_ok=True)
+    data = dict()
+    for figure in figures:
+        try:
+            data[figure] = get_figure_data(figure)
+        except Exception as error:
+            print('Skipping {}: {}'.format(figure, error))
+
+    rendered = list()
+    with ProcessPoolExecutor(max_workers=max(1, min(workers or os.cpu_count() or 1, len(data) or 1))) as executor:
+        futures = {executor.submit(render_figure, figure, figure_data, directory): figure
+                   for figure, figure_data in data.items()}
+        for future in as_completed(futures):
+            try:
+                rendered.append(future.result())
+                print('Rendered {}'.format(futures[future]))
+            except Exception as error:
+                print('Failed to render {}: {}'.format(futures[future], error))
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot the figures, from a menu or all at once with --batch.')
+    parser.add_argument('--batch', action='store_true', help='render the figures without a display and exit')
+    parser.add_argument('--figures', nargs='+', choices=list(figure_sources), help='figures to render (default: all)')
+    parser.add_argument('--output', default='.', help='directory to write the figures to')
+    parser.add_argument('--workers', type=int, help='processes drawing figures (default: one per CPU)')
+    args = parser.parse_args()
+
+    if args.batch:
+        render_figures(args.figures, args.output, args.workers)
+    else:
+        plot_functions = [x for x in dir() if x[:5] == 'plot_']
+        print('Options available:')
+        for i in range(len(plot_functions)):
+            print(str(i + 1) + '. ' + plot_functions[i])
+        print(str(len(plot_functions) + 1) + '. Exit')
+        while True:
+            inp = int(input('Choose an option: '))
+            if inp < 1 or inp > len(plot_functions):
+                break
+            locals()[plot_functions[inp - 1]](directory=args.output)
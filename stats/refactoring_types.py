@@ -0,0 +1,94 @@
+import os
+
+import database
+from cache import digest, get_or_compute
+from database import get_table_state, read_key_join, read_table, stream_key_join, stream_table, streaming_order
+
+# The refactoring types the analyses accept, for all scripts
+accepted_types = ['Change Package', 'Extract And Move Method', 'Extract Interface', 'Extract Method',
+                  'Extract Superclass', 'Inline Method', 'Move And Rename Class', 'Move Attribute', 'Move Class',
+                  'Move Method', 'Pull Up Attribute', 'Pull Up Method', 'Push Down Method', 'Rename Class',
+                  'Rename Method']
+
+# 'join' selects the regions of accepted refactorings by joining the refactoring table in the database. 'client' reads
+# the regions and keeps those of the accepted refactoring ids, taken from the cached types of all refactorings, so that
+# another set of types needs no other query.
+type_filter = os.environ.get('ANALYSIS_TYPE_FILTER', 'join')
+# (backend, state of the refactoring table) -> id and type of every refactoring
+refactoring_types_by_state = dict()
+
+
+def set_accepted_types(types):
+    # in place, for the modules that imported the list
+    accepted_types[:] = list(dict.fromkeys(types))
+
+
+def set_type_filter(name):
+    global type_filter
+    if name not in ['join', 'client']:
+        raise ValueError('Unknown type filter: {}'.format(name))
+    type_filter = name
+
+
+def get_types(types=None):
+    return list(dict.fromkeys(accepted_types if types is None else types))
+
+
+# Filter of read_table and the other loaders on the accepted (or the given) types, bound as one IN parameter
+def get_type_filter(types=None):
+    return [('refactoring_type', 'in', get_types(types))]
+
+
+# Identifies the set of types, whatever their order, for fingerprints and cache keys
+def get_types_key(types=None):
+    return digest(sorted(get_types(types)))
+
+
+# The types as an SQL condition, for display
+def get_sql_condition(types=None):
+    return 'refactoring_type in ({})'.format(', '.join("'{}'".format(ref_type.replace("'", "''"))
+                                                       for ref_type in get_types(types)))
+
+
+# id and refactoring_type of all refactorings, whatever types are accepted, read once per state of the table
+def get_refactoring_types():
+    state = get_table_state('refactoring')
+    key = (database.backend, state)
+    if key not in refactoring_types_by_state:
+        refactoring_types_by_state[key] = get_or_compute(
+            'refactoring_types', lambda: read_table('refactoring', ['id', 'refactoring_type']).astype(
+                {'refactoring_type': 'category'}), fingerprint=digest(state))
+    return refactoring_types_by_state[key]
+
+
+def get_accepted_ids(types=None):
+    refactorings = get_refactoring_types()
+    return refactorings['id'][refactorings['refactoring_type'].isin(get_types(types))].to_numpy()
+
+
+# Rows of df whose refactoring is of an accepted (or given) type, without asking the database
+def filter_accepted(df, key='refactoring_id', types=None):
+    return df[df[key].isin(get_accepted_ids(types))].reset_index(drop=True)
+
+
+# Rows of refactoring_region that belong to refactorings of the accepted (or given) types and match filters
+def read_accepted_regions(columns=None, filters=None, compact=False, types=None):
+    if type_filter == 'client':
+        read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ['refactoring_id']))
+        regions = filter_accepted(read_table('refactoring_region', read_columns, filters, compact=compact),
+                                  types=types)
+        return regions if columns is None else regions[list(columns)]
+    return read_key_join('refactoring_region', columns, 'refactoring_id', 'refactoring', 'id', get_type_filter(types),
+                         filters, compact=compact)
+
+
+# read_accepted_regions chunk by chunk, in the order of the order_by columns (see database.stream_table)
+def stream_accepted_regions(columns=None, filters=None, compact=False, types=None, order_by=streaming_order):
+    if type_filter == 'client':
+        read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ['refactoring_id']))
+        for chunk in stream_table('refactoring_region', read_columns, filters, order_by, compact=compact):
+            regions = filter_accepted(chunk, types=types)
+            yield regions if columns is None else regions[list(columns)]
+    else:
+        yield from stream_key_join('refactoring_region', columns, 'refactoring_id', 'refactoring', 'id',
+                                   get_type_filter(types), filters, order_by, compact=compact)
@@ -1,31 +1,134 @@
-# library & dataset
-import seaborn as sns
+import argparse
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-# df = sns.load_dataset('runtimes')
-csv_data = pd.read_csv("runtimes.csv", delimiter=';')
-# df = pd.concat([row[row['runtime'] < 5000] for row in csv_data])
+from parallel import map_projects
+from sketch import QuantileSketch
+
+# The runtime logs (merge_tool;repo_name;merge_commit;runtime, runtimes in ms) are read chunk by chunk into a running
+# summary per merge tool and per merge tool and repository, so that a log of any length is never in memory as a whole.
+# Means are exact; medians and percentiles come from the sketches (see sketch.py), within relative_accuracy.
+chunk_size = 100000
+relative_accuracy = 0.001
 # filter the extreme values to inspect the major distribution
-df = csv_data[(csv_data['runtime']) < 10000]
-
-intelli = df[(df['merge_tool'] == "IntelliMerge")]
-jfst = df[(df['merge_tool'] == "JFSTMerge")]
-print('Average running time:')
-print('IntelliMerge\t' + str(intelli['runtime'].mean()) + 'ms')
-print('jFSTMerge\t' + str(jfst['runtime'].mean()) + 'ms')
-
-print('Median running time:')
-print('IntelliMerge\t' + str(intelli['runtime'].median()) + 'ms')
-print('jFSTMerge\t' + str(jfst['runtime'].median()) + 'ms')
-
-plt.figure(figsize=(16, 5))
-# Just switch x and y
-# sns.violinplot(y="repo_name", x="runtime", hue="merge_tool", data=df, palette="Set2", split=True, scale="count", inner="box", scale_hue=False, bw=.2)
-sns.violinplot(y=df["merge_tool"], x=df["runtime"], cut=0, inner="box")
-# sns.violinplot(y=df["merge_tool"], x=df["runtime"], cut=2, inner="box")
-# sns.boxplot("runtime", "merge_tool", data=df)
-# sns.stripplot("runtime", "merge_tool", data=df, jitter=True)
-# sns.violinplot(x="merge_tool", y="runtime", data=df)
-plt.show()
-# plt.savefig('runtimes.png')
+max_runtime = 10000
+percentiles = [.25, .5, .75, .9, .95, .99]
+tool_labels = {'JFSTMerge': 'jFSTMerge'}
+
+
+def add_runtimes(sketches, key, runtimes):
+    if key not in sketches:
+        sketches[key] = QuantileSketch(relative_accuracy)
+    sketches[key].add(runtimes.to_numpy())
+
+
+# Sketches of the runtimes of one log by merge tool, and by (merge tool, repository)
+def read_runtime_log(path, max_runtime=max_runtime, chunk_size=chunk_size):
+    by_tool = dict()
+    by_repo = dict()
+    for chunk in pd.read_csv(path, delimiter=';', usecols=['merge_tool', 'repo_name', 'runtime'],
+                             chunksize=chunk_size):
+        if max_runtime is not None:
+            chunk = chunk[chunk['runtime'] < max_runtime]
+        for tool, runtimes in chunk.groupby('merge_tool')['runtime']:
+            add_runtimes(by_tool, tool, runtimes)
+        for key, runtimes in chunk.groupby(['merge_tool', 'repo_name'])['runtime']:
+            add_runtimes(by_repo, key, runtimes)
+    return by_tool, by_repo
+
+
+def merge_sketches(sketches, other):
+    for key, sketch in other.items():
+        if key in sketches:
+            sketches[key].merge(sketch)
+        else:
+            sketches[key] = sketch
+    return sketches
+
+
+# Reads the logs, in parallel with ANALYSIS_WORKERS > 1, and merges their summaries
+def read_runtime_logs(paths, max_runtime=max_runtime, chunk_size=chunk_size):
+    by_tool = dict()
+    by_repo = dict()
+    for tool_sketches, repo_sketches in map_projects(read_runtime_log,
+                                                     [(path, max_runtime, chunk_size) for path in paths]):
+        merge_sketches(by_tool, tool_sketches)
+        merge_sketches(by_repo, repo_sketches)
+    return by_tool, by_repo
+
+
+# One row per key of sketches: count, mean, min, the percentiles and max
+def summarize(sketches, names):
+    rows = list()
+    for key in sorted(sketches):
+        sketch = sketches[key]
+        row = dict(zip(names, key if isinstance(key, tuple) else (key,)))
+        row.update({'count': sketch.count, 'mean': sketch.mean(), 'min': sketch.minimum})
+        row.update(zip(['p{:g}'.format(p * 100) for p in percentiles], sketch.quantile(percentiles)))
+        row['max'] = sketch.maximum
+        rows.append(row)
+    columns = names + ['count', 'mean', 'min'] + ['p{:g}'.format(p * 100) for p in percentiles] + ['max']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def print_runtimes(by_tool):
+    print('Average running time:')
+    for tool in sorted(by_tool):
+        print(tool_labels.get(tool, tool) + '\t' + str(by_tool[tool].mean()) + 'ms')
+    print('Median running time:')
+    for tool in sorted(by_tool):
+        print(tool_labels.get(tool, tool) + '\t' + str(by_tool[tool].median()) + 'ms')
+
+
+# Violin of every merge tool drawn from the bucket counts of its sketch instead of the single runtimes
+def plot_runtimes(by_tool, points=200, show=True, path=None):
+    import matplotlib.pyplot as plt
+    tools = sorted(by_tool)
+    violins = list()
+    for tool in tools:
+        sketch = by_tool[tool]
+        values, cumulative = sketch.cumulative_buckets()
+        coords = np.linspace(sketch.minimum, sketch.maximum, points)
+        density, _ = np.histogram(values, bins=points, range=(sketch.minimum, sketch.maximum),
+                                  weights=np.diff(np.concatenate([[0], cumulative])), density=True)
+        # smooth the histogram over a few bins, like the kernel density estimate of a violin plot
+        kernel = np.exp(-.5 * np.linspace(-2, 2, 9) ** 2)
+        violins.append({'coords': coords, 'vals': np.convolve(density, kernel / kernel.sum(), mode='same'),
+                        'mean': sketch.mean(), 'median': sketch.median(), 'min': sketch.minimum,
+                        'max': sketch.maximum})
+    fig, ax = plt.subplots(figsize=(16, 5))
+    ax.violin(violins, vert=False, showmedians=True)
+    ax.set_yticks(range(1, len(tools) + 1))
+    ax.set_yticklabels([tool_labels.get(tool, tool) for tool in tools])
+    ax.set_xlabel('runtime')
+    ax.set_ylabel('merge_tool')
+    if path is not None:
+        fig.savefig(path)
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the running times of the merge tools.')
+    parser.add_argument('logs', nargs='*', default=['runtimes.csv'], help='runtime logs (default: runtimes.csv)')
+    parser.add_argument('--max-runtime', type=float, default=max_runtime,
+                        help='leave out runtimes from this many ms on, 0 to keep all (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help='rows read at a time')
+    parser.add_argument('--by-repo', action='store_true', help='also print the percentiles per repository')
+    parser.add_argument('--output', help='CSV file to write the summary per merge tool and repository to')
+    parser.add_argument('--plot', action='store_true', help='show a violin plot of the runtimes of every merge tool')
+    args = parser.parse_args()
+
+    by_tool, by_repo = read_runtime_logs(args.logs, args.max_runtime or None, args.chunk_size)
+    print_runtimes(by_tool)
+    print('Percentiles:')
+    print(summarize(by_tool, ['merge_tool']).to_string(index=False))
+    repo_summary = summarize(by_repo, ['merge_tool', 'repo_name'])
+    if args.by_repo:
+        print(repo_summary.to_string(index=False))
+    if args.output:
+        repo_summary.to_csv(args.output, index=False)
+    if args.plot:
+        plot_runtimes(by_tool)
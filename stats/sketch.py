@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+
+# Streaming summary of a distribution: count, sum, min and max exactly, and quantiles to within relative_accuracy of
+# the true value. Values are counted in buckets whose bounds grow geometrically ((g^(i-1), g^i] with
+# g = (1 + relative_accuracy) / (1 - relative_accuracy)), so the memory depends on the range of the values, not on
+# their number, and two sketches of the same accuracy merge by adding up their buckets.
+class QuantileSketch(object):
+    def __init__(self, relative_accuracy=0.001):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket index -> count, for the positive values and for the absolute values of the negative ones
+        self.positive = dict()
+        self.negative = dict()
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add_to_buckets(self, buckets, values):
+        indexes, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            buckets[index] = buckets.get(index, 0) + count
+
+    # Adds an array of values; NaNs are left out
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.add_to_buckets(self.positive, values[values > 0])
+        self.add_to_buckets(self.negative, -values[values < 0])
+        self.zeros += int((values == 0).sum())
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        return self
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different accuracies')
+        for buckets, other_buckets in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    # Value of every bucket in increasing order, with the number of values up to and including it
+    def cumulative_buckets(self):
+        negative = sorted(self.negative.items(), reverse=True)
+        positive = sorted(self.positive.items())
+        values = [-self.bucket_value(index) for index, _ in negative] + [0.] * (self.zeros > 0) + \
+                 [self.bucket_value(index) for index, _ in positive]
+        counts = [count for _, count in negative] + [self.zeros] * (self.zeros > 0) + [count for _, count in positive]
+        return np.array(values), np.cumsum(counts)
+
+    def bucket_value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    # Quantiles for q in [0, 1] (a number or an array), interpolated between the neighbouring ranks like
+    # numpy.percentile and pandas' median do
+    def quantile(self, q):
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, math.nan) if q.ndim else math.nan
+        values, cumulative = self.cumulative_buckets()
+        ranks = q * (self.count - 1)
+        lower = values[np.searchsorted(cumulative, np.floor(ranks), side='right')]
+        upper = values[np.searchsorted(cumulative, np.ceil(ranks), side='right')]
+        result = np.clip(lower + (upper - lower) * (ranks - np.floor(ranks)), self.minimum, self.maximum)
+        return result if q.ndim else float(result)
+
+    def median(self):
+        return self.quantile(.5)
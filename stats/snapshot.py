@@ -0,0 +1,70 @@
+import argparse
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import database
+from database import iter_query, table_schemas
+
+# The analysis tables, and conflicting_java_file for the stats tables of data_resolver.print_stats
+snapshot_tables = ['merge_commit', 'conflicting_region', 'conflicting_region_history', 'refactoring',
+                   'refactoring_region', 'conflicting_java_file']
+
+
+# Arrow schema of a table, fixed from its first chunk and the declared dtypes, so that later chunks holding NULLs or
+# only NULLs in a column still fit it.
+def arrow_schema(chunk, table):
+    declared = table_schemas.get(table, dict())
+    fields = list()
+    for field in pa.Schema.from_pandas(chunk, preserve_index=False):
+        dtype = declared.get(field.name)
+        if dtype == 'object' or (dtype is None and field.type == pa.null()):
+            field = pa.field(field.name, pa.string())
+        elif dtype is not None:
+            field = pa.field(field.name, pa.from_numpy_dtype(np.dtype(dtype)))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+# Streams a table from the database into <directory>/<table>.parquet, one row group per chunk
+def export_table(table, directory, compression='zstd'):
+    print('Exporting table {}'.format(table))
+    path = os.path.join(directory, table + '.parquet')
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    writer = None
+    rows = 0
+    try:
+        for chunk in iter_query('select * from {} order by id'.format(table), table):
+            if writer is None:
+                schema = arrow_schema(chunk, table)
+                writer = pq.ParquetWriter(temporary_path, schema, compression=compression)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+        writer.close()
+        writer = None
+        os.replace(temporary_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.isfile(temporary_path):
+            os.remove(temporary_path)
+    print('Exported {} rows to {}'.format(rows, path))
+    return rows
+
+
+def export_snapshot(directory=None, tables=None, compression='zstd'):
+    directory = directory or database.snapshot_dir
+    os.makedirs(directory, exist_ok=True)
+    return {table: export_table(table, directory, compression) for table in tables or snapshot_tables}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the analysis tables to Parquet files, to be read with ANALYSIS_BACKEND=snapshot.')
+    parser.add_argument('--output', default=database.snapshot_dir, help='directory to write the snapshot to')
+    parser.add_argument('--tables', nargs='+', default=snapshot_tables, choices=snapshot_tables)
+    parser.add_argument('--compression', default='zstd', help='Parquet compression codec (zstd, snappy, gzip, none)')
+    args = parser.parse_args()
+    export_snapshot(args.output, args.tables, args.compression)
@@ -0,0 +1,255 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from refactoring_types import accepted_types
+
+# Refactoring types RefactoringMiner reports besides the accepted ones, which the analyses filter out
+other_types = ['Rename Variable', 'Rename Parameter', 'Rename Attribute', 'Extract Variable', 'Inline Variable',
+               'Change Variable Type']
+conflict_types = ['CONTENT', 'ADD/ADD', 'MODIFY/DELETE', 'RENAME/RENAME', 'RENAME/DELETE']
+conflict_type_weights = [0.82, 0.08, 0.06, 0.02, 0.02]
+
+default_scale = {
+    'projects': 10,
+    'merges': 500,
+    'conflicting_share': 0.3,
+    'files_per_merge': 2.0,
+    'regions_per_file': 2.0,
+    'histories_per_region': 3.0,
+    'refactorings_per_commit': 1.5,
+    'files_per_project': 2000,
+    'path_skew': 1.1,
+    'involved_share': 0.3,
+    'developers': 20,
+}
+
+
+def random_hashes(rng, count):
+    return np.array(['{:016x}{:016x}{:08x}'.format(*values) for values in
+                     zip(rng.integers(0, 2 ** 63, count), rng.integers(0, 2 ** 63, count),
+                         rng.integers(0, 2 ** 31, count))], dtype=object)
+
+
+# Number of children of every parent: at least one, and on average mean
+def child_counts(rng, parents, mean):
+    return 1 + rng.poisson(max(mean - 1, 0), parents)
+
+
+# Files of the projects, of which each project changes a few far more often than the rest: the rank of a file follows
+# a Zipf-like distribution of exponent path_skew (0 spreads the changes evenly)
+class PathSampler(object):
+    def __init__(self, rng, files_per_project, path_skew):
+        self.rng = rng
+        self.files_per_project = files_per_project
+        weights = 1. / np.arange(1, files_per_project + 1) ** path_skew
+        self.cumulative = np.cumsum(weights / weights.sum())
+
+    def sample(self, project_ids):
+        ranks = np.minimum(np.searchsorted(self.cumulative, self.rng.random(len(project_ids))),
+                           self.files_per_project - 1)
+        return np.array(['src/main/java/org/project{}/module{}/Class{}.java'.format(project_id, rank % 40, rank)
+                         for project_id, rank in zip(project_ids, ranks)], dtype=object)
+
+
+def generate_merge_commits(rng, scale):
+    count = scale['projects'] * scale['merges']
+    developers = rng.integers(0, scale['developers'], count)
+    project_ids = np.repeat(np.arange(1, scale['projects'] + 1), scale['merges'])
+    return pd.DataFrame({
+        'id': np.arange(1, count + 1),
+        'commit_hash': random_hashes(rng, count),
+        'parent_1': random_hashes(rng, count),
+        'parent_2': random_hashes(rng, count),
+        'is_conflicting': (rng.random(count) < scale['conflicting_share']).astype(np.int8),
+        'author_name': ['Developer {}'.format(developer) for developer in developers],
+        'author_email': ['developer{}@project{}.org'.format(developer, project_id)
+                         for developer, project_id in zip(developers, project_ids)],
+        'timestamp': 1262304000 + np.sort(rng.integers(0, 290000000, count)),
+        'project_id': project_ids,
+    })
+
+
+def generate_conflicting_java_files(rng, scale, merge_commits, paths):
+    conflicting = merge_commits[merge_commits['is_conflicting'] == 1]
+    counts = child_counts(rng, len(conflicting), scale['files_per_merge'])
+    project_ids = np.repeat(conflicting['project_id'].to_numpy(), counts)
+    return pd.DataFrame({
+        'id': np.arange(1, counts.sum() + 1),
+        'path': paths.sample(project_ids),
+        'type': rng.choice(conflict_types, counts.sum(), p=conflict_type_weights),
+        'merge_commit_id': np.repeat(conflicting['id'].to_numpy(), counts),
+        'project_id': project_ids,
+    })
+
+
+def generate_conflicting_regions(rng, scale, java_files):
+    counts = child_counts(rng, len(java_files), scale['regions_per_file'])
+    count = counts.sum()
+    paths = np.repeat(java_files['path'].to_numpy(), counts)
+    start_lines = rng.integers(1, 800, count)
+    return pd.DataFrame({
+        'id': np.arange(1, count + 1),
+        'parent_1_path': paths,
+        'parent_1_start_line': start_lines,
+        'parent_1_length': rng.integers(1, 40, count),
+        'parent_2_path': paths,
+        'parent_2_start_line': np.maximum(start_lines + rng.integers(-20, 20, count), 1),
+        'parent_2_length': rng.integers(1, 40, count),
+        'conflicting_java_file_id': np.repeat(java_files['id'].to_numpy(), counts),
+        'merge_commit_id': np.repeat(java_files['merge_commit_id'].to_numpy(), counts),
+        'project_id': np.repeat(java_files['project_id'].to_numpy(), counts),
+    })
+
+
+# The commits of either merge parent that changed the lines of each conflicting region. The regions of a merge commit
+# share a pool of such commits, so that a commit usually touches several regions.
+def generate_conflicting_region_histories(rng, scale, merge_commits, conflicting_regions, paths):
+    counts = child_counts(rng, len(conflicting_regions), scale['histories_per_region'])
+    count = counts.sum()
+    regions = conflicting_regions.loc[np.repeat(conflicting_regions.index.to_numpy(), counts)]
+    merge_parents = rng.integers(1, 3, count)
+    project_ids = regions['project_id'].to_numpy()
+
+    pool_size = max(int(scale['histories_per_region'] * scale['regions_per_file']), 1)
+    commit_numbers = rng.integers(0, pool_size, count)
+    commit_keys = pd.Series(list(zip(regions['merge_commit_id'].to_numpy(), merge_parents, commit_numbers)))
+    commit_codes, distinct_commits = pd.factorize(commit_keys)
+    commit_hashes = random_hashes(rng, len(distinct_commits))[commit_codes]
+
+    developers = rng.integers(0, scale['developers'], len(distinct_commits))[commit_codes]
+    start_lines = np.where(merge_parents == 1, regions['parent_1_start_line'].to_numpy(),
+                           regions['parent_2_start_line'].to_numpy())
+    new_paths = regions['parent_1_path'].to_numpy()
+    # a few commits move the file they change
+    renamed = rng.random(count) < 0.05
+    old_paths = new_paths.copy()
+    old_paths[renamed] = paths.sample(project_ids[renamed])
+    timestamps = merge_commits.set_index('id')['timestamp'].reindex(regions['merge_commit_id']).to_numpy()
+    return pd.DataFrame({
+        'id': np.arange(1, count + 1),
+        'commit_hash': commit_hashes,
+        'merge_parent': merge_parents.astype(np.int8),
+        'author_name': ['Developer {}'.format(developer) for developer in developers],
+        'author_email': ['developer{}@project{}.org'.format(developer, project_id)
+                         for developer, project_id in zip(developers, project_ids)],
+        'timestamp': timestamps - rng.integers(3600, 30 * 86400, count),
+        'old_path': old_paths,
+        'old_start_line': np.maximum(start_lines + rng.integers(-30, 30, count), 1),
+        'old_length': rng.integers(0, 30, count),
+        'new_path': new_paths,
+        'new_start_line': start_lines,
+        'new_length': rng.integers(0, 30, count),
+        'conflicting_region_id': regions['id'].to_numpy(),
+        'merge_commit_id': regions['merge_commit_id'].to_numpy(),
+        'project_id': project_ids,
+    })
+
+
+# Refactorings of the evolutionary commits, each with a source ('s') and a destination ('d') region. A share of
+# involved_share of the regions lies on lines of a conflicting region history of the same commit, the others anywhere
+# in the files of the project.
+def generate_refactorings(rng, scale, conflicting_region_histories, paths):
+    commits = conflicting_region_histories.drop_duplicates('commit_hash')
+    counts = rng.poisson(scale['refactorings_per_commit'], len(commits))
+    count = counts.sum()
+    commit_positions = np.repeat(np.arange(len(commits)), counts)
+    project_ids = commits['project_id'].to_numpy()[commit_positions]
+    commit_hashes = commits['commit_hash'].to_numpy()[commit_positions]
+    types = np.array(list(accepted_types) + other_types, dtype=object)
+    refactoring_types = types[rng.integers(0, len(types), count)]
+    refactorings = pd.DataFrame({
+        'id': np.arange(1, count + 1),
+        'refactoring_type': refactoring_types,
+        'refactoring_detail': ['{} in class org.project{}.Class{}'.format(refactoring_type, project_id, number)
+                               for refactoring_type, project_id, number in
+                               zip(refactoring_types, project_ids, rng.integers(0, 1000, count))],
+        'commit_hash': commit_hashes,
+        'refactoring_commit_id': commit_positions + 1,
+        'project_id': project_ids,
+    })
+
+    histories = conflicting_region_histories.groupby('commit_hash').head(1).set_index('commit_hash').reindex(
+        np.repeat(commit_hashes, 2))
+    region_types = np.tile(np.array(['s', 'd'], dtype=object), count)
+    involved = rng.random(2 * count) < scale['involved_share']
+    region_paths = paths.sample(np.repeat(project_ids, 2))
+    start_lines = rng.integers(1, 800, 2 * count)
+    history_paths = np.where(region_types == 's', histories['old_path'].to_numpy(), histories['new_path'].to_numpy())
+    history_lines = np.where(region_types == 's', histories['old_start_line'].to_numpy(),
+                             histories['new_start_line'].to_numpy())
+    region_paths[involved] = history_paths[involved]
+    start_lines[involved] = np.maximum(history_lines[involved] + rng.integers(-10, 10, involved.sum()), 1)
+    refactoring_regions = pd.DataFrame({
+        'id': np.arange(1, 2 * count + 1),
+        'type': region_types,
+        'path': region_paths,
+        'start_line': start_lines,
+        'length': rng.integers(0, 40, 2 * count),
+        'commit_hash': np.repeat(commit_hashes, 2),
+        'refactoring_id': np.repeat(refactorings['id'].to_numpy(), 2),
+        'refactoring_commit_id': np.repeat(refactorings['refactoring_commit_id'].to_numpy(), 2),
+        'project_id': np.repeat(project_ids, 2),
+    })
+    return refactorings, refactoring_regions
+
+
+# All the tables the analyses read, by name, for the given scale (see default_scale)
+def generate_tables(scale=None, seed=0):
+    scale = dict(default_scale, **(scale or dict()))
+    rng = np.random.default_rng(seed)
+    paths = PathSampler(rng, scale['files_per_project'], scale['path_skew'])
+
+    projects = pd.DataFrame({'id': np.arange(1, scale['projects'] + 1)})
+    projects['name'] = ['project{}'.format(project_id) for project_id in projects['id']]
+    projects['url'] = ['https://github.com/synthetic/{}.git'.format(name) for name in projects['name']]
+    merge_commits = generate_merge_commits(rng, scale)
+    java_files = generate_conflicting_java_files(rng, scale, merge_commits, paths)
+    conflicting_regions = generate_conflicting_regions(rng, scale, java_files)
+    conflicting_region_histories = generate_conflicting_region_histories(rng, scale, merge_commits,
+                                                                         conflicting_regions, paths)
+    refactorings, refactoring_regions = generate_refactorings(rng, scale, conflicting_region_histories, paths)
+    return {
+        'project': projects,
+        'merge_commit': merge_commits,
+        'conflicting_java_file': java_files,
+        'conflicting_region': conflicting_regions,
+        'conflicting_region_history': conflicting_region_histories,
+        'refactoring': refactorings,
+        'refactoring_region': refactoring_regions,
+    }
+
+
+# Writes the tables of generate_tables into a SQLite file, which the analyses read with
+# ANALYSIS_DATABASE_URL=sqlite:///<path>. Returns the row count of every table.
+def generate_database(path, scale=None, seed=0):
+    if os.path.isfile(path):
+        os.remove(path)
+    engine = create_engine('sqlite:///' + path)
+    rows = dict()
+    try:
+        for table, df in generate_tables(scale, seed).items():
+            df.to_sql(table, engine, index=False, chunksize=50000)
+            rows[table] = len(df)
+        with engine.connect() as connection:
+            for table in ['conflicting_region_history', 'refactoring_region']:
+                connection.execute(text('create index {0}_project_commit on {0} (project_id, commit_hash)'.format(
+                    table)))
+    finally:
+        engine.dispose()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic refactoring_analysis database in SQLite.')
+    parser.add_argument('--output', default='synthetic.db', help='SQLite file to write')
+    parser.add_argument('--seed', type=int, default=0)
+    for option, value in default_scale.items():
+        parser.add_argument('--' + option.replace('_', '-'), type=type(value), default=value, dest=option)
+    args = vars(parser.parse_args())
+    output, seed = args.pop('output'), args.pop('seed')
+    for table, count in generate_database(output, args, seed).items():
+        print('{}: {} rows'.format(table, count))